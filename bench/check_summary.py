@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# Check that bigwig_extract.py --summary gives the same statistics from the zoom levels as
+# with -exact (full resolution data only).
+#
+# A bigWig and regions of 1 bp to whole chromosomes are generated with generate_data.py, every
+# -bin size is run with and without -exact, and the two summaries are compared line by line:
+#   coverage, min and max must be equal, NA must be NA in both,
+#   mean and sum within a relative tolerance of SUM_TOLERANCE (zoom records store float32 sums).
+# Every mismatch is logged, the exit status is 1 if there is any.
+
+import os
+import sys
+import math
+import random
+import shutil
+import tempfile
+import subprocess
+import logging
+import generate_data
+
+__version__ = '1.0.0'
+
+# logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    lh = logging.StreamHandler()
+    lh.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
+    logger.addHandler(lh)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BIN_DIR = os.path.normpath(os.path.join(BENCH_DIR, os.pardir, 'bin'))
+
+SUM_TOLERANCE = 1e-5
+EXACT_STATS = ['coverage', 'min', 'max']
+BIN_SIZES = [None, 1000, 5000, 20000]
+
+
+def generate_inputs(work_dir, chroms=5, chrom_size=2000000, regions=200, seed=1):
+    # return (bigwig file, regions file)
+    rng = random.Random(seed)
+    chrom_sizes = dict(('chr%d' % (idx + 1), chrom_size + rng.randint(0, chrom_size // 10)) for idx in range(chroms))
+    bigwig_file = os.path.join(work_dir, 'signal.bw')
+    generate_data.generate_bigwig(bigwig_file, chrom_sizes, seed=seed)
+    regions_file = os.path.join(work_dir, 'regions.txt')
+    with open(regions_file, 'w') as out_f:
+        for chrom in chrom_sizes:
+            out_f.write('%s\n' % (chrom))
+        for _ in range(regions):
+            chrom = rng.choice(list(chrom_sizes))
+            # spans from a single base to a few hundred kb, so every zoom level and the short
+            # last bin of a region are used
+            span = int(10 ** rng.uniform(0, 5.5))
+            start = rng.randint(1, max(1, chrom_sizes[chrom] - span))
+            out_f.write('%s:%d-%d\n' % (chrom, start, min(chrom_sizes[chrom], start + span)))
+    return bigwig_file, regions_file
+
+
+def read_summary(summary_file):
+    with open(summary_file) as in_f:
+        header = next(in_f).rstrip('\n').split('\t')
+        return header, [line.rstrip('\n').split('\t') for line in in_f]
+
+
+def compare_summaries(zoom_file, exact_file):
+    # return the number of compared rows, log every mismatch
+    header, zoom_rows = read_summary(zoom_file)
+    exact_header, exact_rows = read_summary(exact_file)
+    if header != exact_header or len(zoom_rows) != len(exact_rows):
+        logger.error('%s and %s have different rows' % (zoom_file, exact_file))
+        return None
+    mismatches = 0
+    for zoom_row, exact_row in zip(zoom_rows, exact_rows):
+        if zoom_row[:4] != exact_row[:4]:
+            logger.error('Different bins: %s / %s' % (' '.join(zoom_row[:4]), ' '.join(exact_row[:4])))
+            return None
+        for stat, zoom_value, exact_value in zip(header[4:], zoom_row[4:], exact_row[4:]):
+            if zoom_value == 'NA' or exact_value == 'NA':
+                same = zoom_value == exact_value
+            elif stat in EXACT_STATS:
+                same = float(zoom_value) == float(exact_value)
+            else:
+                same = math.isclose(float(zoom_value), float(exact_value), rel_tol=SUM_TOLERANCE, abs_tol=1e-6)
+            if not same:
+                mismatches += 1
+                logger.error('%s %s-%s %s: zoom %s, exact %s' % (zoom_row[1], zoom_row[2], zoom_row[3], stat, zoom_value, exact_value))
+    return None if mismatches else len(zoom_rows)
+
+
+def check_summary(work_dir, bin_sizes, threads=1):
+    bigwig_file, regions_file = generate_inputs(work_dir)
+    failed = False
+    for bin_size in bin_sizes:
+        outputs = list()
+        for exact in [False, True]:
+            summary_file = os.path.join(work_dir, 'summary_%s%s.tsv' % (bin_size or 'region', '_exact' if exact else ''))
+            command = [sys.executable, os.path.join(BIN_DIR, 'bigwig_extract.py'), '-in_b', bigwig_file, '-regions', regions_file,
+                       '-summary', summary_file, '-stat', 'mean', 'max', 'min', 'coverage', 'sum', '-t', str(threads), '-no_cache']
+            if bin_size:
+                command += ['-bin', str(bin_size)]
+            if exact:
+                command.append('-exact')
+            if subprocess.call(command) != 0:
+                logger.error('Failed: %s' % (' '.join(command)))
+                sys.exit(1)
+            outputs.append(summary_file)
+        rows = compare_summaries(outputs[0], outputs[1])
+        if rows is None:
+            failed = True
+        else:
+            logger.info('-bin %s: %d rows, zoom = exact' % (bin_size or '(none)', rows))
+    return not failed
+
+
+def main():
+    import argparse
+    from textwrap import dedent
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=dedent("""\
+    Compare the zoom level and the -exact summary statistics of bin/bigwig_extract.py.
+
+    Quick start:
+    %(prog)s
+    %(prog)s -bin 500 2000 -t 4
+    """))
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
+    parser.add_argument('-bin', '--bin_size', type=int, nargs='+', help='Bin sizes to check (0 = whole regions), default: 0 1000 5000 20000', default=None)
+    parser.add_argument('-t', '--threads', type=int, help='Threads of bigwig_extract.py, default: 1', default=1)
+    parser.add_argument('-w', '--work_dir', type=str, help='Keep the inputs and summaries in this directory, default: a temporary directory', default=None)
+
+    args = parser.parse_args()
+    bin_sizes = BIN_SIZES if args.bin_size is None else [bin_size or None for bin_size in args.bin_size]
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='check_summary_')
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    try:
+        passed = check_summary(work_dir, bin_sizes, args.threads)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# Deterministic synthetic inputs for the benchmarks of the bin/ scripts.
+#
+# Every generator takes a seed, so the same arguments always produce byte-identical files
+# (gzip output has no file name and mtime=0). FASTA, TSV, ABI and bigWig files only need the
+# standard library; .sav files need pandas and pyreadstat.
+
+import os
+import sys
+import gzip
+import math
+import random
+import struct
+import logging
+
+__version__ = '1.0.0'
+
+# logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    lh = logging.StreamHandler()
+    lh.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
+    logger.addHandler(lh)
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'bin')
+
+LENGTH_DISTRIBUTIONS = ['fixed', 'uniform', 'lognormal']
+BASES = 'ACGT'
+
+
+def compressed_output(out_f, compress=False):
+    # gzip without a file name and with a fixed mtime, so the output only depends on the seed
+    if compress:
+        return gzip.GzipFile(filename='', mode='wb', fileobj=out_f, mtime=0)
+    return out_f
+
+
+def sequence_length(rng, mean_length, distribution):
+    if distribution == 'fixed':
+        return mean_length
+    if distribution == 'uniform':
+        return rng.randint(1, 2 * mean_length - 1)
+    # lognormal with the requested mean, a few very long records like a real assembly
+    sigma = 1.0
+    mu = math.log(mean_length) - sigma * sigma / 2
+    return max(1, int(rng.lognormvariate(mu, sigma)))
+
+
+def random_sequence(rng, length):
+    return ''.join(rng.choice(BASES) for _ in range(length))
+
+
+def generate_fasta(output_file, records=1000, mean_length=1000, distribution='uniform', line_width=60, compress=False, seed=1):
+    # IDs contain digits (for modification_fasta_ID.py) and some records are shorter than the
+    # default length filter of FilterFastaByLength.py.
+    # Sequences are cut from one random pool, generating every base with random.choice() would
+    # take longer than the benchmarked scripts.
+    # return {'SequenceID': Sequence_length}
+    rng = random.Random(seed)
+    pool = random_sequence(rng, 1 << 16)
+    lengths = dict()
+    with open(output_file, 'wb') as raw_f, compressed_output(raw_f, compress) as out_f:
+        for record_idx in range(records):
+            sequence_id = 'seq%d_%d' % (record_idx + 1, rng.randint(0, 99))
+            length = sequence_length(rng, mean_length, distribution)
+            lengths[sequence_id] = length
+            pieces = list()
+            remaining = length
+            while remaining > 0:
+                start = rng.randrange(len(pool))
+                piece = pool[start:start + remaining]
+                pieces.append(piece)
+                remaining -= len(piece)
+            sequence = ''.join(pieces)
+            lines = ['>%s description %d' % (sequence_id, record_idx)]
+            lines.extend([sequence[i:i + line_width] for i in range(0, length, line_width)])
+            out_f.write(('\n'.join(lines) + '\n').encode('utf-8'))
+    return lengths
+
+
+def generate_tables(output_prefix, samples=4, rows=10000, columns=3, overlap=0.8, seed=1):
+    # Multi-sample TSV tables for merge_table.py: a header line, the index in column 0 and
+    # [columns] value columns (integers, floats and strings). Every sample has about
+    # [overlap] of the indexes in common with the others, in a different order.
+    # return the list of the generated files
+    rng = random.Random(seed)
+    shared = ['gene%07d' % (idx) for idx in range(int(rows * overlap))]
+    output_files = list()
+    for sample_idx in range(samples):
+        keys = list(shared)
+        keys.extend(['gene_s%d_%07d' % (sample_idx, idx) for idx in range(rows - len(shared))])
+        rng.shuffle(keys)
+        output_file = '%s%d.tsv' % (output_prefix, sample_idx + 1)
+        with open(output_file, 'w') as out_f:
+            header = ['id']
+            header.extend(['value%d' % (column_idx + 1) for column_idx in range(columns)])
+            out_f.write('\t'.join(header) + '\n')
+            for key in keys:
+                outline = [key]
+                for column_idx in range(columns):
+                    kind = column_idx % 3
+                    if kind == 0:
+                        outline.append(str(rng.randint(0, 100000)))
+                    elif kind == 1:
+                        outline.append(repr(round(rng.random() * 1000, 4)))
+                    else:
+                        outline.append(rng.choice(['low', 'mid', 'high']))
+                out_f.write('\t'.join(outline) + '\n')
+        output_files.append(output_file)
+    return output_files
+
+
+def generate_sav(output_file, rows=10000, columns=20, seed=1):
+    # numeric and string variables with column labels and value labels
+    try:
+        import pandas as pd
+        import pyreadstat
+    except ImportError:
+        logger.error('pandas and pyreadstat are required to write .sav files')
+        sys.exit(1)
+    rng = random.Random(seed)
+    data = dict()
+    column_labels = list()
+    variable_value_labels = dict()
+    for column_idx in range(columns):
+        name = 'var%d' % (column_idx + 1)
+        kind = column_idx % 3
+        if kind == 0:
+            data[name] = [float(rng.randint(1, 3)) for _ in range(rows)]
+            variable_value_labels[name] = {1.0: 'low', 2.0: 'mid', 3.0: 'high'}
+        elif kind == 1:
+            data[name] = [rng.gauss(50, 10) for _ in range(rows)]
+        else:
+            data[name] = ['item%d' % (rng.randint(0, 999)) for _ in range(rows)]
+        column_labels.append('Variable %d' % (column_idx + 1))
+    df = pd.DataFrame(data, columns=list(data))
+    pyreadstat.write_sav(df, output_file, column_labels=column_labels, variable_value_labels=variable_value_labels)
+
+
+def abi_entry(name, number, element_type, element_size, data, data_offset):
+    # ABIF directory entry, data of at most 4 bytes is stored in the offset field
+    if len(data) <= 4:
+        offset_field = struct.unpack('>I', data.ljust(4, b'\x00'))[0]
+    else:
+        offset_field = data_offset
+    return struct.pack('>4sIHHIIII', name, number, element_type, element_size, len(data) // element_size, len(data), offset_field, 0)
+
+
+def write_abi(output_file, sample_id, sequence, rng):
+    # Minimal ABIF file (Applied Biosystems trace): base calls (PBAS2), quality values (PCON2),
+    # peak locations (PLOC2), sample name (SMPL1) and the four analyzed traces (DATA9-12).
+    trace_length = len(sequence) * 12
+    tags = list()
+    tags.append((b'PBAS', 2, 2, 1, sequence.encode('ascii')))
+    tags.append((b'PCON', 2, 2, 1, bytes(rng.randint(10, 60) for _ in sequence)))
+    tags.append((b'PLOC', 2, 4, 2, struct.pack('>%dh' % (len(sequence)), *[idx * 12 + 6 for idx in range(len(sequence))])))
+    name = sample_id.encode('ascii')
+    tags.append((b'SMPL', 1, 18, 1, struct.pack('B', len(name)) + name))
+    for trace_idx in range(4):
+        trace = [rng.randint(0, 2000) for _ in range(trace_length)]
+        tags.append((b'DATA', 9 + trace_idx, 4, 2, struct.pack('>%dh' % (trace_length), *trace)))
+    # header (128 bytes), tag data, directory
+    data_offset = 128
+    entries = list()
+    body = list()
+    for name, number, element_type, element_size, data in tags:
+        entries.append(abi_entry(name, number, element_type, element_size, data, data_offset))
+        if len(data) > 4:
+            body.append(data)
+            data_offset += len(data)
+    directory = b''.join(entries)
+    header = b'ABIF' + struct.pack('>H4sIHHIIII', 101, b'tdir', 1, 1023, 28, len(entries), len(directory), data_offset, 0)
+    header = header.ljust(128, b'\xff')
+    with open(output_file, 'wb') as out_f:
+        out_f.write(header)
+        out_f.write(b''.join(body))
+        out_f.write(directory)
+
+
+def generate_abi(output_dir, traces=50, mean_length=800, seed=1):
+    # return the list of the generated .ab1 files
+    rng = random.Random(seed)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    output_files = list()
+    for trace_idx in range(traces):
+        sample_id = 'sample%05d' % (trace_idx + 1)
+        length = max(50, int(rng.gauss(mean_length, mean_length / 10.0)))
+        output_file = os.path.join(output_dir, sample_id + '.ab1')
+        write_abi(output_file, sample_id, random_sequence(rng, length), rng)
+        output_files.append(output_file)
+    return output_files
+
+
+def bigwig_intervals(rng, chrom_sizes, mean_span=50, coverage=0.7):
+    # bedGraph-like (chrom, start, end, value) intervals covering about [coverage] of each chrom
+    for chrom in chrom_sizes:
+        position = 0
+        while True:
+            position += int(rng.expovariate(1.0 / (mean_span * (1 - coverage) / coverage)))
+            span = max(1, int(rng.expovariate(1.0 / mean_span)))
+            if position >= chrom_sizes[chrom]:
+                break
+            end = min(position + span, chrom_sizes[chrom])
+            yield chrom, position, end, round(rng.random() * 100, 2)
+            position = end
+
+
+def generate_bigwig(output_file, chrom_sizes, mean_span=50, coverage=0.7, seed=1):
+    # bigWig built with the in-process writer of bin/bigwig.py
+    if BIN_DIR not in sys.path:
+        sys.path.insert(0, BIN_DIR)
+    import bigwig
+    rng = random.Random(seed)
+    bigwig.write_bigwig(output_file, chrom_sizes, bigwig_intervals(rng, chrom_sizes, mean_span, coverage))
+
+
+def generate_regions(output_file, chrom_sizes, regions=100, seed=1):
+    # regions for bigwig_extract.py: RNAME, RNAME:STARTPOS and RNAME:STARTPOS-ENDPOS
+    rng = random.Random(seed)
+    chroms = list(chrom_sizes)
+    with open(output_file, 'w') as out_f:
+        for _ in range(regions):
+            chrom = rng.choice(chroms)
+            # STARTPOS is used as a 0-based start, it must be below the chrom size to give a base
+            start = rng.randint(1, max(1, chrom_sizes[chrom] - 1))
+            end = min(chrom_sizes[chrom], start + rng.randint(1, 10000))
+            form = rng.random()
+            if form < 0.05:
+                out_f.write('%s\n' % (chrom))
+            elif form < 0.1:
+                out_f.write('%s:%d\n' % (chrom, start))
+            else:
+                out_f.write('%s:%d-%d\n' % (chrom, start, end))
+
+
+def main():
+    import argparse
+    from textwrap import dedent
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=dedent("""\
+    Generate deterministic synthetic inputs for the bin/ scripts.
+
+    Quick start:
+    %(prog)s fasta -o genome.fa -n 1000 -l 5000 --distribution lognormal
+    %(prog)s tables -o sample -n 4 -r 100000
+    %(prog)s abi -o traces -n 100
+    %(prog)s bigwig -o signal.bw -f genome.fa
+    """))
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
+    subparsers = parser.add_subparsers(dest='data_type')
+    subparsers.required = True
+    fasta_parser = subparsers.add_parser('fasta', help='FASTA file')
+    fasta_parser.add_argument('-o', '--output', type=str, help='Output file', required=True)
+    fasta_parser.add_argument('-n', '--records', type=int, help='Number of records, default: 1000', default=1000)
+    fasta_parser.add_argument('-l', '--mean_length', type=int, help='Mean sequence length, default: 1000', default=1000)
+    fasta_parser.add_argument('-d', '--distribution', type=str, choices=LENGTH_DISTRIBUTIONS, help='Length distribution, default: uniform', default='uniform')
+    fasta_parser.add_argument('-w', '--line_width', type=int, help='Bases per line, default: 60', default=60)
+    fasta_parser.add_argument('-z', '--gzip', action='store_true', help='gzip compressed output')
+    tables_parser = subparsers.add_parser('tables', help='Multi-sample TSV tables for merge_table.py')
+    tables_parser.add_argument('-o', '--output', type=str, help='Output prefix, files are [prefix][N].tsv', required=True)
+    tables_parser.add_argument('-n', '--samples', type=int, help='Number of samples, default: 4', default=4)
+    tables_parser.add_argument('-r', '--rows', type=int, help='Rows per sample, default: 10000', default=10000)
+    tables_parser.add_argument('-c', '--columns', type=int, help='Value columns, default: 3', default=3)
+    sav_parser = subparsers.add_parser('sav', help='SPSS .sav file (needs pandas and pyreadstat)')
+    sav_parser.add_argument('-o', '--output', type=str, help='Output file', required=True)
+    sav_parser.add_argument('-r', '--rows', type=int, help='Rows, default: 10000', default=10000)
+    sav_parser.add_argument('-c', '--columns', type=int, help='Variables, default: 20', default=20)
+    abi_parser = subparsers.add_parser('abi', help='ABI trace files')
+    abi_parser.add_argument('-o', '--output', type=str, help='Output directory', required=True)
+    abi_parser.add_argument('-n', '--traces', type=int, help='Number of traces, default: 50', default=50)
+    abi_parser.add_argument('-l', '--mean_length', type=int, help='Mean read length, default: 800', default=800)
+    bigwig_parser = subparsers.add_parser('bigwig', help='bigWig file')
+    bigwig_parser.add_argument('-o', '--output', type=str, help='Output file', required=True)
+    bigwig_parser.add_argument('-f', '--fasta', type=str, help='Use the sequence lengths of this FASTA file as chrom sizes', required=True)
+    bigwig_parser.add_argument('-span', '--mean_span', type=int, help='Mean interval length, default: 50', default=50)
+    for sub_parser in [fasta_parser, tables_parser, sav_parser, abi_parser, bigwig_parser]:
+        sub_parser.add_argument('-seed', '--seed', type=int, help='Random seed, default: 1', default=1)
+
+    args = parser.parse_args()
+    if args.data_type == 'fasta':
+        generate_fasta(args.output, args.records, args.mean_length, args.distribution, args.line_width, args.gzip, args.seed)
+    elif args.data_type == 'tables':
+        generate_tables(args.output, args.samples, args.rows, args.columns, seed=args.seed)
+    elif args.data_type == 'sav':
+        generate_sav(args.output, args.rows, args.columns, args.seed)
+    elif args.data_type == 'abi':
+        generate_abi(args.output, args.traces, args.mean_length, args.seed)
+    elif args.data_type == 'bigwig':
+        if BIN_DIR not in sys.path:
+            sys.path.insert(0, BIN_DIR)
+        import fasta_index
+        chrom_sizes = fasta_index.sequence_lengths(args.fasta, save=False)
+        generate_bigwig(args.output, chrom_sizes, args.mean_span, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# Benchmark the bin/ scripts on deterministic synthetic inputs.
+#
+# Every script is run as a subprocess of the current Python interpreter, timed with a
+# monotonic clock and reaped with os.wait4(), so the peak RSS (ru_maxrss) and CPU time of the
+# child, and of the worker processes it waited for, are recorded without extra dependencies.
+# The results are written as JSON (one file per commit by default) and can be compared with
+# the results of another commit with --compare.
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import importlib.util
+import subprocess
+import logging
+import generate_data
+
+__version__ = '1.0.0'
+
+# logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    lh = logging.StreamHandler()
+    lh.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
+    logger.addHandler(lh)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BIN_DIR = os.path.normpath(os.path.join(BENCH_DIR, os.pardir, 'bin'))
+
+# input size = base size x scale
+SIZES = {
+    'small': 1,
+    'medium': 10,
+    'large': 100
+}
+
+
+def git_commit():
+    # (commit, working tree has uncommitted changes)
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+        status = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BENCH_DIR, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, bool(status)
+
+
+def missing_modules(modules):
+    return [module for module in modules if importlib.util.find_spec(module) is None]
+
+
+def file_size(files):
+    return sum(os.path.getsize(input_file) for input_file in files)
+
+
+def remove_files(*files):
+    for remove_file in files:
+        if os.path.exists(remove_file):
+            os.remove(remove_file)
+
+
+def run_command(command, log_file, cwd):
+    # return (exit status, wall time, rusage)
+    with open(log_file, 'ab') as log_f:
+        log_f.write(('$ %s\n' % (' '.join(command))).encode('utf-8'))
+        log_f.flush()
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=log_f, stderr=log_f, cwd=cwd)
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+        # the child is already reaped, keep Popen from waiting for it again
+        process.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status >> 8
+    return process.returncode, wall_time, rusage
+
+
+def prepare_fasta(work_dir, scale):
+    fasta_file = os.path.join(work_dir, 'genome.fa')
+    lengths = generate_data.generate_fasta(fasta_file, records=1000 * scale, mean_length=1000, distribution='lognormal')
+    generate_data.generate_fasta(fasta_file + '.gz', records=1000 * scale, mean_length=1000, distribution='lognormal', compress=True)
+    return fasta_file, len(lengths)
+
+
+def prepare_bigwig(work_dir, scale):
+    # 10 chromosomes of 100 kb x scale and a bigWig covering 70% of them
+    genome_file = os.path.join(work_dir, 'bigwig_genome.fa')
+    chrom_sizes = generate_data.generate_fasta(genome_file, records=10, mean_length=100000 * scale, distribution='fixed')
+    bigwig_file = os.path.join(work_dir, 'signal.bw')
+    generate_data.generate_bigwig(bigwig_file, chrom_sizes)
+    regions_file = os.path.join(work_dir, 'regions.txt')
+    generate_data.generate_regions(regions_file, chrom_sizes, regions=100 * scale)
+    return genome_file, bigwig_file, regions_file
+
+
+def benchmark_cases(work_dir, scale):
+    # Generate the inputs of one size and return the benchmark cases:
+    # {'name', 'script', 'args', 'inputs', 'records', 'setup' (called before every run), 'requires'}
+    cases = list()
+    fasta_file, fasta_records = prepare_fasta(work_dir, scale)
+    for suffix in ['', '.gz']:
+        fasta_input = fasta_file + suffix
+        label = 'gzip' if suffix else 'plain'
+        cases.append({
+            'name': 'FilterFastaByLength/%s' % (label),
+            'script': 'FilterFastaByLength.py',
+            'args': ['-i', fasta_input, '-l', '500', '-r', os.path.join(work_dir, 'filter_report.txt')],
+            'inputs': [fasta_input],
+            'records': fasta_records
+        })
+        cases.append({
+            'name': 'modification_fasta_ID/%s' % (label),
+            'script': 'modification_fasta_ID.py',
+            'args': ['-i', fasta_input, '-o', os.path.join(work_dir, 'modified.fa'), '-s', os.path.join(work_dir, 'modified_summary.txt')],
+            'inputs': [fasta_input],
+            'records': fasta_records
+        })
+        cases.append({
+            'name': 'fasta_index/%s' % (label),
+            'script': 'fasta_index.py',
+            'args': ['-f', fasta_input, '-c', os.path.join(work_dir, 'chrom.size')],
+            'inputs': [fasta_input],
+            'records': fasta_records,
+            # measure building the index, not reading a saved one
+            'setup': lambda fasta_input=fasta_input: remove_files(fasta_input + '.fai')
+        })
+        cases.append({
+            'name': 'fasta_pipeline/%s' % (label),
+            'script': 'fasta_pipeline.py',
+            'args': ['-i', fasta_input, '-o', os.path.join(work_dir, 'pipeline.fa'), '-l', '500', '-clean', '-translate',
+                     '-r', os.path.join(work_dir, 'pipeline_report.txt'), '-s', os.path.join(work_dir, 'pipeline_summary.txt'),
+                     '-size', os.path.join(work_dir, 'pipeline_chrom.size')],
+            'inputs': [fasta_input],
+            'records': fasta_records
+        })
+
+    table_files = generate_data.generate_tables(os.path.join(work_dir, 'sample'), samples=4, rows=10000 * scale, columns=3)
+    table_records = 4 * 10000 * scale
+    cases.append({
+        'name': 'merge_table/memory',
+        'script': 'merge_table.py',
+        'args': ['-i'] + table_files + ['-skip', '1', '-target', '1', '2', '3', '-o', os.path.join(work_dir, 'merge.tsv')],
+        'inputs': table_files,
+        'records': table_records
+    })
+    cases.append({
+        'name': 'merge_table/sorted',
+        'script': 'merge_table.py',
+        'args': ['-i'] + table_files + ['-skip', '1', '-target', '1', '2', '3', '-sorted', '-buffer', '10000', '-tmp', work_dir, '-o', os.path.join(work_dir, 'merge_sorted.tsv')],
+        'inputs': table_files,
+        'records': table_records
+    })
+
+    genome_file, bigwig_file, regions_file = prepare_bigwig(work_dir, scale)
+    cases.append({
+        'name': 'bigwig_extract/builtin',
+        'script': 'bigwig_extract.py',
+        'args': ['-in_b', bigwig_file, '-regions', regions_file, '-f', genome_file, '-out_b', os.path.join(work_dir, 'extract.bw'), '--no_cache'],
+        'inputs': [bigwig_file, genome_file],
+        'records': 100 * scale,
+        'setup': lambda: remove_files(genome_file + '.fai')
+    })
+    cases.append({
+        'name': 'bigwig_extract/summary',
+        'script': 'bigwig_extract.py',
+        'args': ['-in_b', bigwig_file, '-regions', regions_file, '-summary', os.path.join(work_dir, 'summary.tsv'), '-bin', '1000'],
+        'inputs': [bigwig_file],
+        'records': 100 * scale
+    })
+    cases.append({
+        'name': 'bigwig_extract/header',
+        'script': 'bigwig_extract.py',
+        'args': ['-in_b', bigwig_file, '-regions', regions_file, '-out_b', os.path.join(work_dir, 'extract.bw')],
+        'inputs': [bigwig_file],
+        'records': 100 * scale
+    })
+
+    abi_files = generate_data.generate_abi(os.path.join(work_dir, 'abi'), traces=20 * scale)
+    cases.append({
+        'name': 'abi2fasta',
+        'script': 'abi2fasta.py',
+        'args': ['-i'] + abi_files + ['-o', os.path.join(work_dir, 'abi')],
+        'inputs': abi_files,
+        'records': len(abi_files),
+        'requires': ['Bio']
+    })
+    cases.append({
+        'name': 'abi2fasta/cache',
+        'script': 'abi2fasta.py',
+        'args': ['-i'] + abi_files + ['-o', os.path.join(work_dir, 'abi_cached'), '-cache', os.path.join(work_dir, 'abi_cache')],
+        'inputs': abi_files,
+        'records': len(abi_files),
+        'requires': ['Bio']
+    })
+
+    sav_file = os.path.join(work_dir, 'table.sav')
+    sav_requires = ['pandas', 'pyreadstat']
+    if not missing_modules(sav_requires):
+        generate_data.generate_sav(sav_file, rows=10000 * scale, columns=20)
+    cases.append({
+        'name': 'sav_to_tsv',
+        'script': 'sav_to_tsv.py',
+        'args': ['-i', sav_file, '-o', os.path.join(work_dir, 'table.tsv')],
+        'inputs': [sav_file],
+        'records': 10000 * scale,
+        'requires': sav_requires
+    })
+    return cases
+
+
+def run_case(case, size, repeat, work_dir):
+    result = {
+        'name': case['name'],
+        'script': case['script'],
+        'size': size,
+        'records': case['records']
+    }
+    missing = missing_modules(case.get('requires', list()))
+    if missing:
+        logger.warning('%s (%s): skipped, missing module(s): %s' % (case['name'], size, ', '.join(missing)))
+        result['skipped'] = 'missing module(s): %s' % (', '.join(missing))
+        return result
+    result['input_bytes'] = file_size(case['inputs'])
+    command = [sys.executable, os.path.join(BIN_DIR, case['script'])] + case['args']
+    log_file = os.path.join(work_dir, 'benchmark.log')
+    runs = list()
+    for _ in range(repeat):
+        if 'setup' in case:
+            case['setup']()
+        returncode, wall_time, rusage = run_command(command, log_file, work_dir)
+        if returncode != 0:
+            logger.warning('%s (%s): exit status %d, see %s' % (case['name'], size, returncode, log_file))
+            result['error'] = 'exit status %d' % (returncode)
+            return result
+        runs.append({
+            'wall_time': wall_time,
+            'user_time': rusage.ru_utime,
+            'sys_time': rusage.ru_stime,
+            # kilobytes on Linux
+            'peak_rss_kb': rusage.ru_maxrss
+        })
+    wall_time = min(run['wall_time'] for run in runs)
+    result['runs'] = runs
+    result['wall_time'] = wall_time
+    result['peak_rss_kb'] = max(run['peak_rss_kb'] for run in runs)
+    result['throughput_mb_s'] = result['input_bytes'] / 1e6 / wall_time
+    result['records_s'] = case['records'] / wall_time
+    logger.info('%-32s %-6s %8.3f s %8.1f MB/s %8d KB' % (case['name'], size, wall_time, result['throughput_mb_s'], result['peak_rss_kb']))
+    return result
+
+
+def run_benchmarks(sizes, repeat=3, work_dir=None, only=None):
+    commit, dirty = git_commit()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeat': repeat,
+        'results': list()
+    }
+    for size in sizes:
+        if work_dir is None:
+            size_dir = tempfile.mkdtemp(prefix='bench_%s_' % (size))
+        else:
+            size_dir = os.path.join(work_dir, size)
+            if not os.path.isdir(size_dir):
+                os.makedirs(size_dir)
+        try:
+            logger.info('Generating the %s inputs in %s' % (size, size_dir))
+            for case in benchmark_cases(size_dir, SIZES[size]):
+                if only and not any(name in case['name'] for name in only):
+                    continue
+                report['results'].append(run_case(case, size, repeat, size_dir))
+        finally:
+            if work_dir is None:
+                shutil.rmtree(size_dir, ignore_errors=True)
+    return report
+
+
+def compare_reports(old_report, new_report):
+    # print the wall time and peak RSS of new_report relative to old_report
+    old_results = dict(((result['name'], result['size']), result) for result in old_report['results'])
+    print('%-32s %-6s %10s %10s %8s %10s %10s %8s' % ('benchmark', 'size', 'old (s)', 'new (s)', 'ratio', 'old (KB)', 'new (KB)', 'ratio'))
+    for result in new_report['results']:
+        old_result = old_results.get((result['name'], result['size']))
+        if old_result is None or 'wall_time' not in result or 'wall_time' not in old_result:
+            continue
+        print('%-32s %-6s %10.3f %10.3f %8.2f %10d %10d %8.2f' % (
+            result['name'], result['size'],
+            old_result['wall_time'], result['wall_time'], result['wall_time'] / old_result['wall_time'],
+            old_result['peak_rss_kb'], result['peak_rss_kb'], float(result['peak_rss_kb']) / old_result['peak_rss_kb']))
+
+
+def main():
+    import argparse
+    from textwrap import dedent
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=dedent("""\
+    Benchmark the bin/ scripts on deterministic synthetic inputs.
+    Wall time, CPU time, peak RSS and throughput are written as JSON.
+
+    Quick start:
+    %(prog)s
+    %(prog)s -s small medium -r 5 -o results.json
+    %(prog)s --only merge_table --compare bench/results/abc1234.json
+    """))
+    # argument
+    parser.add_argument('-s', '--sizes', nargs='+', choices=list(SIZES), help='Input sizes, default: small', default=['small'])
+    parser.add_argument('-r', '--repeat', type=int, help='Runs per benchmark, the fastest run is reported, default: 3', default=3)
+    parser.add_argument('-only', '--only', nargs='+', help='Only run the benchmarks whose name contains one of these strings')
+    parser.add_argument('-w', '--work_dir', type=str, help='Keep the generated inputs and outputs in this directory, default: a temporary directory')
+    parser.add_argument('-o', '--output', type=str, help='Output JSON file, default: bench/results/[commit].json')
+    parser.add_argument('-compare', '--compare', type=str, help='Compare the results with a previous JSON file')
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
+
+    args = parser.parse_args()
+    report = run_benchmarks(args.sizes, args.repeat, args.work_dir, args.only)
+    output_file = args.output
+    if output_file is None:
+        results_dir = os.path.join(BENCH_DIR, 'results')
+        if not os.path.isdir(results_dir):
+            os.makedirs(results_dir)
+        output_file = os.path.join(results_dir, '%s%s.json' % (report['commit'], '-dirty' if report['dirty'] else ''))
+    with open(output_file, 'w') as out_f:
+        json.dump(report, out_f, indent=2, sort_keys=True)
+        out_f.write('\n')
+    logger.info('Results written to %s' % (output_file))
+    if args.compare:
+        with open(args.compare, 'r') as in_f:
+            compare_reports(json.load(in_f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,30 @@
 #!/usr/bin/env python
 # Contributed by Li-Mei Chiang <dytk2134 [at] gmail [dot] com> (2020)
 
+"""
+
+Changelog:
+    1.1.0: The records are streamed instead of loaded into a dict keyed by ID. Records with a duplicate ID are
+           all kept (and reported), in input order, with a warning; 1.0.0 kept one record per ID, the sequence
+           of the last one at the position of the first one. The warning compares the first word of the
+           headers, only remembered as 64-bit digests.
+
+"""
+
 import os
 import sys
-import gzip
+import shutil
 import logging
+import tempfile
+import multiprocessing
+import compressed_io
+import fasta_core
+import instrument
+import seq_stats
+# re-exported for scripts importing them from here
+from fasta_core import fasta_iter, fasta_reader, replace_reserved_char
 
-__version__ = '1.0.0'
+__version__ = '1.1.0'
 
 # logger
 logger = logging.getLogger(__name__)
@@ -16,51 +34,97 @@ if not logger.handlers:
     lh.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
     logger.addHandler(lh)
 
-def fasta_reader(fasta_file):
-    magic_number = b'\x1f\x8b\x08'
-    fasta_dict = dict()
-    # check if file exist
-    if not os.path.exists(fasta_file):
-        logger.error('%s: No Such file or directory' % (fasta_file))
-        sys.exit(1)
-    with open(fasta_file, 'rb') as in_f:
-        file_start = in_f.read(len(magic_number))
-    if file_start.startswith(magic_number):
-        in_f = gzip.open(fasta_file, 'rb')
+def filter_fasta(input_file, output_file, length, report_out, threads=1, compress=False, content=None):
+    # filter by length (and content with a seq_stats.ContentFilter), writing each record and its
+    # report line as soon as the record ends
+    # return {'records': ..., 'remain': ..., 'remove': ..., 'collisions': ...}
+    with compressed_io.open_output(output_file, compress, threads) as out_f:
+        return fasta_core.run_pipeline(input_file, out_f, min_length=length, clean_ids=True, report_out=report_out, threads=threads, content=content)
+
+def output_file_name(input_file, postfix, compress=False):
+    filename, fileext = os.path.splitext(input_file)
+    output_file = filename + postfix + fileext
+    if compress:
+        output_file = compressed_io.compressed_file_name(output_file)
+    return output_file
+
+def filter_file_job(job):
+    # Filter one input file and write its report section to section_file, and its histogram
+    # section to histogram_file when content_options (seq_stats.ContentFilter arguments) asks for it.
+    # Errors are caught, so one bad file does not stop the batch; the partial output is removed.
+    # return (stats, None) or (None, error message)
+    input_file, output_file, length, section_file, threads, compress, content_options, histogram_file = job
+    try:
+        content = None
+        if content_options is not None:
+            content = seq_stats.ContentFilter(**content_options)
+        with open(section_file, 'w') as report_out:
+            report_out.write('#filename: %s\n' % (input_file))
+            # header
+            outline = ['#Old_Fasta_ID', 'New_Fasta_ID', 'Length', 'Status']
+            if content is not None:
+                outline.extend(seq_stats.STAT_COLUMNS)
+            report_out.write('\t'.join(outline) + '\n')
+            stats = filter_fasta(input_file, output_file, length, report_out, threads, compress, content)
+        if content is not None and content.histogram is not None:
+            with open(histogram_file, 'w') as histogram_out:
+                content.histogram.write(histogram_out, input_file)
+        return stats, None
+    except SystemExit:
+        # the reason is already logged
+        error = 'see the error above'
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    return None, error
+
+def filter_files(input_files, postfix, length, report_file, threads=1, compress=False, jobs=1, content_options=None, histogram_file=None):
+    # Filter the input files, jobs > 1 filters them concurrently in worker processes.
+    # Every file gets its own report (and histogram) section in a scratch directory, the sections
+    # are appended to report_file (and histogram_file) in input order, so the report is the same
+    # as in a serial run.
+    # return (number of records, [failed input files])
+    scratch_dir = tempfile.mkdtemp(prefix='FilterFastaByLength.', dir=os.path.dirname(os.path.abspath(report_file)))
+    file_jobs = list()
+    for idx, input_file in enumerate(input_files):
+        section_file = os.path.join(scratch_dir, 'section_%d.txt' % (idx))
+        section_histogram_file = os.path.join(scratch_dir, 'histogram_%d.txt' % (idx))
+        file_jobs.append((input_file, output_file_name(input_file, postfix, compress), length, section_file, threads, compress, content_options, section_histogram_file))
+    pool = None
+    if jobs > 1 and len(file_jobs) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(file_jobs)))
+        results = pool.imap(filter_file_job, file_jobs)
     else:
-        in_f = open(fasta_file, 'r')
-    fasta_dict = dict()
-    fasta_id = None
-    for line in in_f:
-        if isinstance(line, bytes):
-            line = line.decode('utf-8')
-        line = line.strip()
-        if len(line) > 0:
-            if line[0] == '>':
-                fasta_id = line[1:]
-                fasta_dict[fasta_id] = {
-                    'sequence_list': list(),
-                    'seqs': str()
-                }
-
-            else:
-                fasta_dict[fasta_id]['sequence_list'].append(line)
-                fasta_dict[fasta_id]['seqs'] += line
-    in_f.close()
-    return fasta_dict
-
-def replace_reserved_char(fasta_id):
-    # Linux reserved characters
-    reserved_char = set(['/', '>', '<', ':', '&', '\'', '\"', '\\'])
-    new_fasta_id = str()
-    fasta_ids = fasta_id.split(' ')
-    for c in fasta_ids[0]:
-        if c in reserved_char:
-            new_c = '_'
-        else:
-            new_c = c
-        new_fasta_id += new_c
-    return new_fasta_id
+        results = map(filter_file_job, file_jobs)
+    records = 0
+    failed = list()
+    try:
+        histogram_out = None
+        if histogram_file:
+            histogram_out = open(histogram_file, 'w')
+        with open(report_file, 'w') as report_out:
+            for job, (stats, error) in zip(file_jobs, results):
+                input_file, section_file, section_histogram_file = job[0], job[3], job[7]
+                if error is not None:
+                    logger.error('%s: Failed to filter the file (%s), it is left out of the report' % (input_file, error))
+                    failed.append(input_file)
+                    continue
+                records += stats['records']
+                with open(section_file, 'r') as section_f:
+                    shutil.copyfileobj(section_f, report_out)
+                os.remove(section_file)
+                if histogram_out is not None:
+                    with open(section_histogram_file, 'r') as section_f:
+                        shutil.copyfileobj(section_f, histogram_out)
+                    os.remove(section_histogram_file)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if histogram_out is not None:
+            histogram_out.close()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    return records, failed
 
 def main():
     import argparse
@@ -76,32 +140,44 @@ def main():
     parser.add_argument('-l', '--length', type=int, help='filtered sequences that were <[length] in fasta file, default: 50', default=50)
     parser.add_argument('-p', '--postfix', type=str, help='The filename postfix for modified features, default: _filtered', default='_filtered')
     parser.add_argument('-r', '--report', type=str, help='Generate a table of comparison between old and new IDs. default: report.txt', default='report.txt')
+    parser.add_argument('-t', '--threads', type=int, help='Threads for BGZF decompression/compression, default: 1', default=1)
+    parser.add_argument('-c', '--compress', action='store_true', help='Write BGZF compressed output (.gz)')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of input files filtered in parallel worker processes, default: 1', default=1)
+    # sequence content (needs numpy)
+    parser.add_argument('-content', '--content_stats', action='store_true', help='Add the GC fraction, N fraction, low-complexity (DUST) score and longest homopolymer of every sequence to the report (implied by the content filters and --histogram)')
+    parser.add_argument('-min_gc', '--min_gc', type=float, help='Remove the sequences with a GC fraction < [min_gc]')
+    parser.add_argument('-max_gc', '--max_gc', type=float, help='Remove the sequences with a GC fraction > [max_gc]')
+    parser.add_argument('-max_n', '--max_n', type=float, help='Remove the sequences with a fraction of N/ambiguous bases > [max_n]')
+    parser.add_argument('-max_complexity', '--max_complexity', type=float, help='Remove the sequences with a low-complexity (DUST) score > [max_complexity]')
+    parser.add_argument('-max_homopolymer', '--max_homopolymer', type=int, help='Remove the sequences with a homopolymer run longer than [max_homopolymer]')
+    parser.add_argument('-histogram', '--histogram', type=str, help='Write the length and GC histograms of every input file to this file')
+    instrument.add_arguments(parser)
     parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
 
     args = parser.parse_args()
+    instrument.start('FilterFastaByLength', __version__, args)
 
-    with open(args.report, 'w') as report_out:
-        for input_file in args.input_files:
-            report_out.write('#filename: %s\n' % (input_file))
-            # header
-            outline = ['#Old_Fasta_ID', 'New_Fasta_ID', 'Length', 'Status']
-            report_out.write('\t'.join(outline) + '\n')
+    if args.jobs < 1:
+        logger.error('Option --jobs requires a positive integer: %d' % (args.jobs))
+        sys.exit(1)
+    if args.threads < 1:
+        logger.error('Option --threads requires a positive integer: %d' % (args.threads))
+        sys.exit(1)
 
-            filename, fileext = os.path.splitext(input_file)
-            output_file = filename + args.postfix + fileext
-            fasta_dict = fasta_reader(input_file)
-            # filter by length
-            with open(output_file, 'w') as out_f:
-                for fasta_id in fasta_dict:
-                    if len(fasta_dict[fasta_id]['seqs']) < args.length:
-                        outline = [fasta_id, 'NA', str(len(fasta_dict[fasta_id]['seqs'])), 'remove']
-                    else:
-                        new_fasta_id = replace_reserved_char(fasta_id)
-                        outline = [fasta_id, new_fasta_id, str(len(fasta_dict[fasta_id]['seqs'])), 'remain']
-                        out_f.write('>' + new_fasta_id + '\n')
-                        for line in fasta_dict[fasta_id]['sequence_list']:
-                            out_f.write(line + '\n')
-                    report_out.write('\t'.join(outline) + '\n')
+    content_options = None
+    content_filters = dict((option, getattr(args, option)) for option in ['min_gc', 'max_gc', 'max_n', 'max_complexity', 'max_homopolymer'] if getattr(args, option) is not None)
+    if args.content_stats or content_filters or args.histogram:
+        # fail early if numpy is missing
+        seq_stats.import_numpy()
+        content_options = dict(content_filters)
+        content_options['histogram'] = bool(args.histogram)
+
+    with instrument.stage('filter', jobs=args.jobs) as stage:
+        records, failed = filter_files(args.input_files, args.postfix, args.length, args.report, args.threads, args.compress, args.jobs, content_options, args.histogram)
+        stage.add(records=records)
+    if failed:
+        logger.error('%d of %d file(s) failed: %s' % (len(failed), len(args.input_files), ', '.join(failed)))
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -3,8 +3,14 @@
 
 import os
 import sys
+import time
+import uuid
+import hashlib
 import logging
+import functools
+import multiprocessing
 from Bio import SeqIO
+import instrument
 
 __version__ = '1.0.0'
 
@@ -16,24 +22,160 @@ if not logger.handlers:
     lh.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
     logger.addHandler(lh)
 
-def abi2fasta(input_files):
-    fasta_dict = dict()
-    for input_file in input_files:
-        record = SeqIO.read(input_file, 'abi')
-        if record.id in fasta_dict:
-            logger.error('Duplicate Seq ID: %s' % (record.id))
-            sys.exit(1)
-        fasta_dict[record.id] = record.seq
-    return fasta_dict
-
-def write_fasta(fasta_dict, output_prefix):
+# bump when the decoded records change, so older cache entries are not used
+CACHE_FORMAT = 'abi2fasta-1'
+CACHE_KEYS = ['content', 'stat']
+# temporary cache files older than this are removed by evict()
+STALE_TMP_SECONDS = 3600
+
+def read_abi(input_file):
+    # decode one trace, the sequence is converted to a string only once
+    record = SeqIO.read(input_file, 'abi')
+    return record.id, str(record.seq)
+
+class TraceCache(object):
+    # On-disk cache of decoded traces, one small file ([key].txt: ID and sequence lines) per trace.
+    # key_mode 'content' keys the entries by a hash of the file content, 'stat' by the path, size
+    # and mtime (no read at all). Entries are written to a unique temporary file and renamed, so
+    # concurrent runs only ever see complete entries; a hit refreshes the mtime of the entry and
+    # evict() removes the least recently used entries above max_bytes.
+    def __init__(self, cache_dir, key_mode='content', max_bytes=256 << 20):
+        self.cache_dir = cache_dir
+        self.key_mode = key_mode
+        self.max_bytes = max_bytes
+
+    def key(self, input_file):
+        digest = hashlib.blake2b(CACHE_FORMAT.encode('utf-8'), digest_size=20)
+        if self.key_mode == 'content':
+            with open(input_file, 'rb') as in_f:
+                for block in iter(lambda: in_f.read(1 << 20), b''):
+                    digest.update(block)
+        else:
+            stat = os.stat(input_file)
+            digest.update(('%s\t%d\t%d' % (os.path.abspath(input_file), stat.st_size, stat.st_mtime_ns)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def entry_file(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.txt')
+
+    def get(self, key):
+        # return (seq_id, sequence), None when the entry is missing or broken
+        entry_file = self.entry_file(key)
+        try:
+            with open(entry_file, 'r') as in_f:
+                lines = in_f.read().split('\n')
+        except (IOError, OSError):
+            return None
+        try:
+            # most recently used
+            os.utime(entry_file)
+        except OSError:
+            pass
+        if len(lines) != 3 or lines[2] != '':
+            return None
+        return lines[0], lines[1]
+
+    def put(self, key, seq_id, seq):
+        entry_file = self.entry_file(key)
+        tmp_file = '%s.%s.tmp' % (entry_file, uuid.uuid4().hex)
+        try:
+            os.makedirs(os.path.dirname(entry_file), exist_ok=True)
+            with open(tmp_file, 'w') as out_f:
+                out_f.write(seq_id + '\n' + seq + '\n')
+            os.replace(tmp_file, entry_file)
+        except (IOError, OSError) as e:
+            logger.warning('%s: Failed to write the cache entry (%s)' % (entry_file, e))
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def evict(self):
+        # remove the least recently used entries until the cache is within max_bytes
+        # entries removed by a concurrent run are skipped
+        entries = list()
+        total = 0
+        now = time.time()
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                entry_file = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(entry_file)
+                    if filename.endswith('.tmp') and stat.st_mtime < now - STALE_TMP_SECONDS:
+                        # left behind by a run that was killed while writing
+                        os.remove(entry_file)
+                        continue
+                except OSError:
+                    continue
+                if not filename.endswith('.txt'):
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry_file))
+                total += stat.st_size
+        entries.sort()
+        removed = 0
+        for mtime, size, entry_file in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(entry_file)
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+        return removed
+
+def read_abi_cached(input_file, cache=None):
+    # return (seq_id, sequence, True if it came from the cache)
+    if cache is None:
+        seq_id, seq = read_abi(input_file)
+        return seq_id, seq, False
+    key = cache.key(input_file)
+    record = cache.get(key)
+    if record is not None:
+        return record[0], record[1], True
+    seq_id, seq = read_abi(input_file)
+    cache.put(key, seq_id, seq)
+    return seq_id, seq, False
+
+def abi2fasta(input_files, jobs=1, cache=None, counts=None):
+    # yield (seq_id, sequence) in input order, traces are decoded by a process pool when jobs > 1
+    # counts = {'hits': ...} is updated with the traces served by the cache
+    seq_ids = set()
+    pool = None
+    read_trace = functools.partial(read_abi_cached, cache=cache)
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        records = pool.imap(read_trace, input_files)
+    else:
+        records = map(read_trace, input_files)
+    try:
+        for seq_id, seq, hit in records:
+            if hit and counts is not None:
+                counts['hits'] += 1
+            if seq_id in seq_ids:
+                logger.error('Duplicate Seq ID: %s' % (seq_id))
+                sys.exit(1)
+            seq_ids.add(seq_id)
+            yield seq_id, seq
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+def write_fasta(records, output_prefix):
+    # records = iterable of (seq_id, sequence), written as they come;
+    # the output is only put in place when all the records were written
     output_file = output_prefix + '.fasta'
-    with open(output_file, 'w') as out_f:
-        for seq_id in fasta_dict:
-            out_f.write('>' + seq_id + '\n')
-            seqs = [str(fasta_dict[seq_id])[i:i+80] for i in range(0, len(str(fasta_dict[seq_id])), 80)]
-            for seq in seqs:
-                out_f.write(seq + '\n')
+    tmp_file = '%s.tmp%d' % (output_file, os.getpid())
+    try:
+        with open(tmp_file, 'w') as out_f:
+            for seq_id, seq in records:
+                out_f.write('>' + seq_id + '\n')
+                for i in range(0, len(seq), 80):
+                    out_f.write(seq[i:i+80] + '\n')
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    os.replace(tmp_file, output_file)
+
 def main():
     import argparse
     from textwrap import dedent
@@ -41,16 +183,40 @@ def main():
     This script is for converting ABI files to FASTA files.
 
     Quick start:
-    %(prog)s 
+    %(prog)s -i plate1/*.ab1 -o plate1
+    %(prog)s -i plate1/*.ab1 -o plate1 -cache abi_cache -cache_size 512
     """))
     # argument
     parser.add_argument('-i', '--input_files', nargs='+', help='Input ABI files', required=True)
     parser.add_argument('-o', '--output_prefix', type=str, help='Specify the output prefix', default='output')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of worker processes decoding ABI files, default: 1', default=1)
+    parser.add_argument('-cache', '--cache_dir', type=str, help='Keep the decoded traces in this cache directory, unchanged traces are not decoded again')
+    parser.add_argument('-cache_key', '--cache_key', choices=CACHE_KEYS, help='Identify unchanged traces by a hash of their content, or by their path, size and mtime, default: content', default='content')
+    parser.add_argument('-cache_size', '--cache_size', type=int, help='Size limit of the cache in MB, the least recently used traces are removed, default: 256', default=256)
+    instrument.add_arguments(parser)
     parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
 
     args = parser.parse_args()
-    fasta_dict = abi2fasta(args.input_files)
-    write_fasta(fasta_dict, args.output_prefix)
+    instrument.start('abi2fasta', __version__, args)
+    if args.jobs < 1:
+        logger.error('Option --jobs requires a positive integer: %d' % (args.jobs))
+        sys.exit(1)
+    if args.cache_size < 0:
+        logger.error('Option --cache_size does not accept negative integer: %d' % (args.cache_size))
+        sys.exit(1)
+    cache = None
+    if args.cache_dir:
+        cache = TraceCache(args.cache_dir, args.cache_key, args.cache_size << 20)
+    counts = {'hits': 0}
+    # decoding and writing are interleaved, so they are one stage
+    with instrument.stage('convert') as stage:
+        write_fasta(abi2fasta(args.input_files, args.jobs, cache, counts), args.output_prefix)
+        stage.add(records=len(args.input_files))
+    if cache is not None:
+        logger.info('%d of %d trace(s) served from the cache' % (counts['hits'], len(args.input_files)))
+        with instrument.stage('cache_evict') as stage:
+            removed = cache.evict()
+            stage.add(records=removed)
 
 
 
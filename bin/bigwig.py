@@ -0,0 +1,592 @@
+#!/usr/bin/env python
+# In-process bigWig reader/writer.
+#
+# Implements the parts of the BBI file format (Kent et al. 2010) needed to extract regions
+# from a bigWig file and to write a new one:
+#   header, zoom headers, total summary, chromosome B+ tree, R-tree (cirTree) index and
+#   zlib compressed data blocks (bedGraph, varStep and fixedStep sections).
+# Only the standard library is used (struct + zlib), so no UCSC binary is needed.
+
+import os
+import zlib
+import bisect
+import struct
+import logging
+
+__version__ = '1.0.0'
+
+# logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    lh = logging.StreamHandler()
+    lh.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
+    logger.addHandler(lh)
+
+BIGWIG_MAGIC = 0x888FFC26
+CHROM_TREE_MAGIC = 0x78CA8C91
+CIR_TREE_MAGIC = 0x2468ACE0
+BBI_VERSION = 4
+MAX_ZOOM_LEVELS = 10
+ZOOM_INCREMENT = 4
+# section types
+BEDGRAPH_SECTION = 1
+VARSTEP_SECTION = 2
+FIXEDSTEP_SECTION = 3
+# parsed R-tree nodes kept by a reader (up to 256 items each)
+NODE_CACHE_SIZE = 1024
+
+
+class BigWigError(Exception):
+    pass
+
+
+class BigWigReader(object):
+    def __init__(self, bigwig_file, block_cache_size=64):
+        if not os.path.exists(bigwig_file):
+            raise BigWigError('%s: No Such file or directory' % (bigwig_file))
+        self.bigwig_file = bigwig_file
+        self.f = open(bigwig_file, 'rb')
+        # decoded blocks, keyed by file offset, so neighbouring regions do not decompress a block twice
+        self.block_cache = dict()
+        self.block_cache_size = block_cache_size
+        # parsed sections of the full resolution blocks, keyed by file offset
+        self.section_cache = dict()
+        # parsed R-tree nodes, keyed by file offset
+        self.node_cache = dict()
+        try:
+            self._read_header()
+            self._read_chrom_tree()
+        except (struct.error, zlib.error) as e:
+            self.f.close()
+            raise BigWigError('%s: Not a valid bigWig file (%s)' % (bigwig_file, e))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def _read(self, offset, size):
+        self.f.seek(offset)
+        return self.f.read(size)
+
+    def _read_header(self):
+        data = self._read(0, 64)
+        for endian in ('<', '>'):
+            if struct.unpack(endian + 'I', data[:4])[0] == BIGWIG_MAGIC:
+                self.endian = endian
+                break
+        else:
+            raise BigWigError('%s: Not a bigWig file' % (self.bigwig_file))
+        (_, self.version, self.zoom_level_count, self.chrom_tree_offset, self.full_data_offset,
+         self.full_index_offset, _, _, _, self.total_summary_offset, self.uncompress_buf_size,
+         _) = struct.unpack(self.endian + 'IHHQQQHHQQIQ', data)
+        # zoom_levels = [{'reduction': ..., 'data_offset': ..., 'index_offset': ...}]
+        self.zoom_levels = list()
+        data = self._read(64, 24 * self.zoom_level_count)
+        for idx in range(self.zoom_level_count):
+            reduction, _, data_offset, index_offset = struct.unpack_from(self.endian + 'IIQQ', data, idx * 24)
+            self.zoom_levels.append({
+                'reduction': reduction,
+                'data_offset': data_offset,
+                'index_offset': index_offset
+            })
+        self.total_summary = None
+        if self.total_summary_offset:
+            bases_covered, min_value, max_value, sum_data, sum_squares = struct.unpack(
+                self.endian + 'Qdddd', self._read(self.total_summary_offset, 40))
+            self.total_summary = {
+                'bases_covered': bases_covered,
+                'min': min_value,
+                'max': max_value,
+                'sum': sum_data,
+                'sum_squares': sum_squares
+            }
+
+    def _read_chrom_tree(self):
+        magic, block_size, key_size, val_size, item_count, _ = struct.unpack(
+            self.endian + 'IIIIQQ', self._read(self.chrom_tree_offset, 32))
+        if magic != CHROM_TREE_MAGIC:
+            raise BigWigError('%s: Bad chromosome B+ tree magic' % (self.bigwig_file))
+        # chroms = {'chrom': (chrom_id, chrom_size)}
+        self.chroms = dict()
+        self.chrom_names = dict()
+        self._read_chrom_node(self.chrom_tree_offset + 32, key_size)
+
+    def _read_chrom_node(self, offset, key_size):
+        is_leaf, _, count = struct.unpack(self.endian + 'BBH', self._read(offset, 4))
+        item_size = key_size + 8
+        data = self.f.read(count * item_size)
+        for idx in range(count):
+            item = data[idx * item_size:(idx + 1) * item_size]
+            key = item[:key_size].rstrip(b'\x00').decode('utf-8')
+            if is_leaf:
+                chrom_id, chrom_size = struct.unpack(self.endian + 'II', item[key_size:])
+                self.chroms[key] = (chrom_id, chrom_size)
+                self.chrom_names[chrom_id] = key
+            else:
+                child_offset = struct.unpack(self.endian + 'Q', item[key_size:])[0]
+                self._read_chrom_node(child_offset, key_size)
+
+    def chrom_sizes(self):
+        # chrom_sizes = {'chrom': chrom_size}, in chromosome ID order
+        return dict((self.chrom_names[chrom_id], self.chroms[self.chrom_names[chrom_id]][1]) for chrom_id in sorted(self.chrom_names))
+
+    def _find_blocks(self, index_offset, chrom_id, start, end):
+        # walk the R-tree and return the (offset, size) of the data blocks overlapping the region
+        blocks = list()
+        self._find_blocks_in_node(index_offset + 48, chrom_id, start, end, blocks)
+        return blocks
+
+    def _find_blocks_in_node(self, offset, chrom_id, start, end, blocks):
+        is_leaf, items, item_ends = self._read_index_node(offset)
+        # the items of a node are sorted and do not overlap, skip to the first one ending after start
+        for idx in range(bisect.bisect_right(item_ends, (chrom_id, start)), len(items)):
+            start_chrom, start_base, end_chrom, end_base, child = items[idx]
+            if (start_chrom, start_base) >= (chrom_id, end):
+                break
+            if is_leaf:
+                blocks.append(child)
+            else:
+                self._find_blocks_in_node(child, chrom_id, start, end, blocks)
+
+    def _read_index_node(self, offset):
+        # return (is_leaf, [(start_chrom, start_base, end_chrom, end_base, (offset, size) or child offset)],
+        # [(end_chrom, end_base)]) of an R-tree node, parsed once
+        if offset in self.node_cache:
+            return self.node_cache[offset]
+        is_leaf, _, count = struct.unpack(self.endian + 'BBH', self._read(offset, 4))
+        if is_leaf:
+            items = [(start_chrom, start_base, end_chrom, end_base, (data_offset, data_size)) for start_chrom, start_base, end_chrom, end_base, data_offset, data_size in struct.iter_unpack(self.endian + 'IIIIQQ', self.f.read(count * 32))]
+        else:
+            items = list(struct.iter_unpack(self.endian + 'IIIIQ', self.f.read(count * 24)))
+        node = (is_leaf, items, [(item[2], item[3]) for item in items])
+        if len(self.node_cache) >= NODE_CACHE_SIZE:
+            self.node_cache.pop(next(iter(self.node_cache)))
+        self.node_cache[offset] = node
+        return node
+
+    def _read_block(self, offset, size):
+        if offset in self.block_cache:
+            return self.block_cache[offset]
+        data = self._read(offset, size)
+        if self.uncompress_buf_size > 0:
+            data = zlib.decompress(data)
+        if len(self.block_cache) >= self.block_cache_size:
+            self.block_cache.pop(next(iter(self.block_cache)))
+        self.block_cache[offset] = data
+        return data
+
+    def _region(self, chrom, start, end):
+        if chrom not in self.chroms:
+            return None
+        chrom_id, chrom_size = self.chroms[chrom]
+        if start is None or start < 0:
+            start = 0
+        if end is None or end > chrom_size:
+            end = chrom_size
+        return chrom_id, start, end
+
+    def intervals(self, chrom, start=None, end=None):
+        # return [(start, end, value)] of chrom:start-end (0-based, half-open), clipped to the region
+        region = self._region(chrom, start, end)
+        if region is None:
+            return list()
+        chrom_id, start, end = region
+        intervals = list()
+        if start >= end:
+            return intervals
+        for offset, size in self._find_blocks(self.full_index_offset, chrom_id, start, end):
+            section_chrom, items, item_ends = self._read_section(offset, size)
+            if section_chrom != chrom_id:
+                continue
+            # the items of a section are sorted and do not overlap, skip to the first one ending after start
+            for idx in range(bisect.bisect_right(item_ends, start), len(items)):
+                item_start, item_end, value = items[idx]
+                if item_start >= end:
+                    break
+                intervals.append((max(item_start, start), min(item_end, end), value))
+        return intervals
+
+    def _read_section(self, offset, size):
+        # return (chrom_id, [(start, end, value)], [end]) of a full resolution block, parsed once
+        if offset in self.section_cache:
+            return self.section_cache[offset]
+        endian = self.endian
+        data = self._read_block(offset, size)
+        (section_chrom, section_start, section_end, item_step, item_span, section_type, _,
+         item_count) = struct.unpack_from(endian + 'IIIIIBBH', data, 0)
+        if section_type == BEDGRAPH_SECTION:
+            items = list(struct.iter_unpack(endian + 'IIf', data[24:24 + item_count * 12]))
+        elif section_type == VARSTEP_SECTION:
+            items = [(item_start, item_start + item_span, value) for item_start, value in struct.iter_unpack(endian + 'If', data[24:24 + item_count * 8])]
+        elif section_type == FIXEDSTEP_SECTION:
+            items = [(section_start + idx * item_step, section_start + idx * item_step + item_span, value[0]) for idx, value in enumerate(struct.iter_unpack(endian + 'f', data[24:24 + item_count * 4]))]
+        else:
+            raise BigWigError('%s: Unknown section type %d' % (self.bigwig_file, section_type))
+        section = (section_chrom, items, [item[1] for item in items])
+        if len(self.section_cache) >= self.block_cache_size:
+            self.section_cache.pop(next(iter(self.section_cache)))
+        self.section_cache[offset] = section
+        return section
+
+    def intervals_many(self, regions):
+        # regions = [(chrom, start, end)], all extracted with this open file
+        return [self.intervals(chrom, start, end) for chrom, start, end in regions]
+
+    def zoom_records(self, zoom_idx, chrom, start=None, end=None):
+        # return [(start, end, valid_count, min, max, sum, sum_squares)] from a zoom level, not clipped
+        region = self._region(chrom, start, end)
+        if region is None:
+            return list()
+        chrom_id, start, end = region
+        records = list()
+        if start >= end:
+            return records
+        index_offset = self.zoom_levels[zoom_idx]['index_offset']
+        for offset, size in self._find_blocks(index_offset, chrom_id, start, end):
+            data = self._read_block(offset, size)
+            for record_chrom, record_start, record_end, valid_count, min_value, max_value, sum_data, sum_squares in struct.iter_unpack(self.endian + 'IIIIffff', data):
+                if record_chrom == chrom_id and record_start < end and record_end > start:
+                    records.append((record_start, record_end, valid_count, min_value, max_value, sum_data, sum_squares))
+        return records
+
+
+def _tree_levels(item_count, block_size):
+    # number of nodes in every level of a tree with block_size children per node, from the leaves up
+    level_counts = [max(1, (item_count + block_size - 1) // block_size)]
+    while level_counts[-1] > 1:
+        level_counts.append((level_counts[-1] + block_size - 1) // block_size)
+    return level_counts
+
+
+def write_chrom_tree(out_f, chrom_items):
+    # chrom_items = [(name_bytes, chrom_id, chrom_size)], sorted by name
+    item_count = len(chrom_items)
+    block_size = max(1, min(256, item_count))
+    key_size = max([1] + [len(name) for name, _, _ in chrom_items])
+    out_f.write(struct.pack('<IIIIQQ', CHROM_TREE_MAGIC, block_size, key_size, 8, item_count, 0))
+    node_size = 4 + block_size * (key_size + 8)
+    # levels from the root down
+    level_counts = _tree_levels(item_count, block_size)[::-1]
+    level_offsets = list()
+    offset = out_f.tell()
+    for count in level_counts:
+        level_offsets.append(offset)
+        offset += count * node_size
+    for level, count in enumerate(level_counts):
+        is_leaf = level == len(level_counts) - 1
+        # number of leaf items under one item of this level
+        items_per_child = block_size ** (len(level_counts) - 1 - level)
+        for node in range(count):
+            first_item = node * block_size * items_per_child
+            children = list()
+            for child in range(block_size):
+                item_idx = first_item + child * items_per_child
+                if item_idx >= item_count:
+                    break
+                children.append(item_idx)
+            out_f.write(struct.pack('<BBH', 1 if is_leaf else 0, 0, len(children)))
+            for child, item_idx in enumerate(children):
+                name, chrom_id, chrom_size = chrom_items[item_idx]
+                key = name + b'\x00' * (key_size - len(name))
+                if is_leaf:
+                    out_f.write(key + struct.pack('<II', chrom_id, chrom_size))
+                else:
+                    child_offset = level_offsets[level + 1] + (node * block_size + child) * node_size
+                    out_f.write(key + struct.pack('<Q', child_offset))
+            out_f.write(b'\x00' * ((block_size - len(children)) * (key_size + 8)))
+
+
+def write_cir_tree(out_f, index_items, end_file_offset, block_size=256, items_per_slot=1024):
+    # index_items = [(start_chrom, start_base, end_chrom, end_base, offset, size)], sorted by start
+    item_count = len(index_items)
+    if index_items:
+        start_chrom, start_base = index_items[0][:2]
+        end_chrom, end_base = max((item[2], item[3]) for item in index_items)
+    else:
+        start_chrom = start_base = end_chrom = end_base = 0
+    out_f.write(struct.pack('<IIQIIIIQII', CIR_TREE_MAGIC, block_size, item_count, start_chrom, start_base,
+                            end_chrom, end_base, end_file_offset, items_per_slot, 0))
+    # bounding boxes of the nodes of every level, from the leaves up
+    node_boxes = list()
+    children = [(item[0], item[1], item[2], item[3]) for item in index_items]
+    for _ in _tree_levels(item_count, block_size):
+        parents = list()
+        for first in range(0, len(children), block_size):
+            group = children[first:first + block_size]
+            end = max((child[2], child[3]) for child in group)
+            parents.append((group[0][0], group[0][1], end[0], end[1]))
+        if not parents:
+            # an empty tree still has a root
+            parents.append((0, 0, 0, 0))
+        node_boxes.append(parents)
+        children = parents
+    # levels from the root down
+    node_boxes = node_boxes[::-1]
+    depth = len(node_boxes)
+    node_sizes = [4 + block_size * 24] * (depth - 1) + [4 + block_size * 32]
+    level_offsets = list()
+    offset = out_f.tell()
+    for level in range(depth):
+        level_offsets.append(offset)
+        offset += len(node_boxes[level]) * node_sizes[level]
+    for level in range(depth):
+        is_leaf = level == depth - 1
+        if is_leaf:
+            items = index_items
+        else:
+            items = node_boxes[level + 1]
+        for node in range(len(node_boxes[level])):
+            group = items[node * block_size:(node + 1) * block_size]
+            out_f.write(struct.pack('<BBH', 1 if is_leaf else 0, 0, len(group)))
+            for child, item in enumerate(group):
+                if is_leaf:
+                    out_f.write(struct.pack('<IIIIQQ', *item))
+                else:
+                    child_offset = level_offsets[level + 1] + (node * block_size + child) * node_sizes[level + 1]
+                    out_f.write(struct.pack('<IIIIQ', item[0], item[1], item[2], item[3], child_offset))
+            out_f.write(b'\x00' * ((block_size - len(group)) * (32 if is_leaf else 24)))
+
+
+class BigWigWriter(object):
+    # Write a bigWig file from intervals. Intervals of a chromosome must be added in one run,
+    # sorted by start and non-overlapping (the same rule as bedGraphToBigWig).
+    def __init__(self, bigwig_file, chrom_sizes, items_per_slot=1024, block_size=256, compress=True):
+        self.bigwig_file = bigwig_file
+        self.items_per_slot = items_per_slot
+        self.block_size = block_size
+        self.compress = compress
+        # chromosome IDs follow the sorted chromosome names, like in the UCSC tools
+        names = sorted(chrom_sizes, key=lambda chrom: chrom.encode('utf-8'))
+        self.chroms = dict((chrom, (chrom_id, chrom_sizes[chrom])) for chrom_id, chrom in enumerate(names))
+        self.out_f = open(bigwig_file, 'w+b')
+        # header, zoom headers and total summary are filled in by close()
+        self.out_f.write(b'\x00' * (64 + 24 * MAX_ZOOM_LEVELS))
+        self.total_summary_offset = self.out_f.tell()
+        self.out_f.write(b'\x00' * 40)
+        self.chrom_tree_offset = self.out_f.tell()
+        write_chrom_tree(self.out_f, [(chrom.encode('utf-8'), self.chroms[chrom][0], self.chroms[chrom][1]) for chrom in names])
+        self.full_data_offset = self.out_f.tell()
+        self.out_f.write(struct.pack('<Q', 0))
+        self.index_items = list()
+        self.uncompress_buf_size = 0
+        self.done_chroms = set()
+        self.chrom = None
+        self.chrom_id = None
+        self.last_end = 0
+        self.section = list()
+        # total summary
+        self.interval_count = 0
+        self.bases_covered = 0
+        self.min_value = float('inf')
+        self.max_value = float('-inf')
+        self.sum_data = 0.0
+        self.sum_squares = 0.0
+        self.max_chrom_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.out_f.close()
+
+    def _write_block(self, data):
+        self.uncompress_buf_size = max(self.uncompress_buf_size, len(data))
+        if self.compress:
+            data = zlib.compress(data)
+        offset = self.out_f.tell()
+        self.out_f.write(data)
+        return offset, len(data)
+
+    def _flush_section(self):
+        if not self.section:
+            return
+        section = self.section
+        header = struct.pack('<IIIIIBBH', self.chrom_id, section[0][0], section[-1][1], 0, 0, BEDGRAPH_SECTION, 0, len(section))
+        items = b''.join([struct.pack('<IIf', start, end, value) for start, end, value in section])
+        offset, size = self._write_block(header + items)
+        self.index_items.append((self.chrom_id, section[0][0], self.chrom_id, section[-1][1], offset, size))
+        self.section = list()
+
+    def add_intervals(self, chrom, intervals):
+        # intervals = [(start, end, value)] on chrom
+        if chrom != self.chrom:
+            self._flush_section()
+            if chrom in self.done_chroms:
+                raise BigWigError('%s: Intervals of %s are not contiguous, the input is not sorted' % (self.bigwig_file, chrom))
+            if chrom not in self.chroms:
+                raise BigWigError('%s: %s is not in the chrom sizes' % (self.bigwig_file, chrom))
+            self.done_chroms.add(chrom)
+            self.chrom = chrom
+            self.chrom_id, chrom_size = self.chroms[chrom]
+            self.chrom_size = chrom_size
+            self.max_chrom_size = max(self.max_chrom_size, chrom_size)
+            self.last_end = 0
+        for start, end, value in intervals:
+            if start < self.last_end:
+                raise BigWigError('%s: Overlapping or unsorted intervals on %s at %d' % (self.bigwig_file, chrom, start))
+            if end <= start:
+                continue
+            if end > self.chrom_size:
+                raise BigWigError('%s: End coordinate %d bigger than %s size of %d' % (self.bigwig_file, end, chrom, self.chrom_size))
+            self.last_end = end
+            self.section.append((start, end, value))
+            span = end - start
+            self.interval_count += 1
+            self.bases_covered += span
+            self.min_value = min(self.min_value, value)
+            self.max_value = max(self.max_value, value)
+            self.sum_data += value * span
+            self.sum_squares += value * value * span
+            if len(self.section) >= self.items_per_slot:
+                self._flush_section()
+
+    def _data_intervals(self):
+        # read back the full resolution data written so far, in (chrom_id, start) order
+        for chrom_id, _, _, _, offset, size in self.index_items:
+            self.out_f.seek(offset)
+            data = self.out_f.read(size)
+            if self.compress:
+                data = zlib.decompress(data)
+            item_count = struct.unpack_from('<H', data, 22)[0]
+            for start, end, value in struct.iter_unpack('<IIf', data[24:24 + item_count * 12]):
+                yield chrom_id, start, end, value
+
+    def _zoom_reductions(self):
+        if not self.interval_count:
+            return list()
+        # start from 10 times the mean interval span, then zoom out by ZOOM_INCREMENT
+        reduction = max(1, (self.bases_covered // self.interval_count) * 10)
+        reductions = list()
+        while len(reductions) < MAX_ZOOM_LEVELS and reduction <= self.max_chrom_size:
+            reductions.append(reduction)
+            reduction *= ZOOM_INCREMENT
+        return reductions
+
+    def _compute_zoom_levels(self, reductions):
+        # records are aligned bins of each reduction
+        # Only the first level is summarized from the data, in one pass; every other reduction is
+        # a multiple of the previous one, so its bins are the union of whole bins of the previous
+        # level and are summarized from those records.
+        # zoom_data = [bytearray of packed (chrom_id, start, end, valid_count, min, max, sum, sum_squares)]
+        chrom_sizes = dict(self.chroms[chrom] for chrom in self.chroms)
+        reduction = reductions[0]
+        records = list()
+        record = None
+        for chrom_id, start, end, value in self._data_intervals():
+            bin_start = start - start % reduction
+            while bin_start < end:
+                bin_end = bin_start + reduction
+                if record is None or record[1] != bin_start or record[0] != chrom_id:
+                    record = [chrom_id, bin_start, min(bin_end, chrom_sizes[chrom_id]), 0, value, value, 0.0, 0.0]
+                    records.append(record)
+                elif value < record[4]:
+                    record[4] = value
+                elif value > record[5]:
+                    record[5] = value
+                overlap = (end if end < bin_end else bin_end) - (start if start > bin_start else bin_start)
+                record[3] += overlap
+                record[6] += value * overlap
+                record[7] += value * value * overlap
+                bin_start = bin_end
+        pack = struct.Struct('<IIIIffff').pack
+        zoom_data = [bytearray(b''.join([pack(*record) for record in records]))]
+        for reduction in reductions[1:]:
+            level_records = list()
+            record = None
+            for chrom_id, start, end, valid_count, min_value, max_value, sum_data, sum_squares in records:
+                bin_start = start - start % reduction
+                if record is None or record[1] != bin_start or record[0] != chrom_id:
+                    record = [chrom_id, bin_start, min(bin_start + reduction, chrom_sizes[chrom_id]), valid_count, min_value, max_value, sum_data, sum_squares]
+                    level_records.append(record)
+                    continue
+                record[3] += valid_count
+                if min_value < record[4]:
+                    record[4] = min_value
+                if max_value > record[5]:
+                    record[5] = max_value
+                record[6] += sum_data
+                record[7] += sum_squares
+            records = level_records
+            zoom_data.append(bytearray(b''.join([pack(*record) for record in records])))
+        return zoom_data
+
+    def _write_zoom_level(self, data):
+        # write the zoom records in blocks of items_per_slot and index them with an R-tree
+        data_offset = self.out_f.tell()
+        record_count = len(data) // 32
+        self.out_f.write(struct.pack('<I', record_count))
+        index_items = list()
+        block_bytes = self.items_per_slot * 32
+        for first in range(0, len(data), block_bytes):
+            block = bytes(data[first:first + block_bytes])
+            start_chrom, start_base = struct.unpack_from('<II', block, 0)
+            end_chrom, _, end_base = struct.unpack_from('<III', block, len(block) - 32)
+            offset, size = self._write_block(block)
+            index_items.append((start_chrom, start_base, end_chrom, end_base, offset, size))
+        index_offset = self.out_f.tell()
+        write_cir_tree(self.out_f, index_items, index_offset, self.block_size, self.items_per_slot)
+        return data_offset, index_offset
+
+    def close(self):
+        self._flush_section()
+        out_f = self.out_f
+        self.chrom_names = dict((self.chroms[chrom][0], chrom) for chrom in self.chroms)
+        section_count = len(self.index_items)
+        # full resolution index
+        self.index_items.sort()
+        full_index_offset = out_f.tell()
+        write_cir_tree(out_f, self.index_items, full_index_offset, self.block_size, self.items_per_slot)
+        # zoom levels, each must summarize at least twice as few records as the previous one
+        zoom_headers = list()
+        reductions = self._zoom_reductions()
+        previous_count = self.interval_count
+        if reductions:
+            zoom_data = self._compute_zoom_levels(reductions)
+            for reduction, data in zip(reductions, zoom_data):
+                record_count = len(data) // 32
+                if record_count * 2 > previous_count:
+                    break
+                out_f.seek(0, os.SEEK_END)
+                data_offset, index_offset = self._write_zoom_level(data)
+                zoom_headers.append((reduction, data_offset, index_offset))
+                previous_count = record_count
+        # header
+        out_f.seek(0)
+        out_f.write(struct.pack('<IHHQQQHHQQIQ', BIGWIG_MAGIC, BBI_VERSION, len(zoom_headers), self.chrom_tree_offset,
+                                self.full_data_offset, full_index_offset, 0, 0, 0, self.total_summary_offset,
+                                self.uncompress_buf_size if self.compress else 0, 0))
+        for reduction, data_offset, index_offset in zoom_headers:
+            out_f.write(struct.pack('<IIQQ', reduction, 0, data_offset, index_offset))
+        out_f.seek(self.total_summary_offset)
+        if self.bases_covered:
+            out_f.write(struct.pack('<Qdddd', self.bases_covered, self.min_value, self.max_value, self.sum_data, self.sum_squares))
+        else:
+            out_f.write(struct.pack('<Qdddd', 0, 0.0, 0.0, 0.0, 0.0))
+        out_f.seek(self.full_data_offset)
+        out_f.write(struct.pack('<Q', section_count))
+        out_f.close()
+
+
+def write_bigwig(bigwig_file, chrom_sizes, intervals):
+    # intervals = iterable of (chrom, start, end, value), grouped by chrom and sorted by start
+    with BigWigWriter(bigwig_file, chrom_sizes) as writer:
+        chrom = None
+        batch = list()
+        for interval_chrom, start, end, value in intervals:
+            if interval_chrom != chrom or len(batch) >= 65536:
+                if batch:
+                    writer.add_intervals(chrom, batch)
+                chrom = interval_chrom
+                batch = list()
+            batch.append((start, end, value))
+        if batch:
+            writer.add_intervals(chrom, batch)
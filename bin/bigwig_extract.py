@@ -9,6 +9,12 @@
 """
 
 Changelog:
+    1.6.0: Per-region / per-bin summary statistics (--summary), from the zoom records inside every bin when the resolution allows (same values as -exact)
+    1.5.0: Without -f/--fasta the chrom sizes are read from the bigWig header; sizes from a FASTA are cached (--cache_dir, --no_cache)
+    1.4.0: Per-stage statistics (--stats) and cProfile output (--profile)
+    1.3.0: Merge the extracted regions with a streaming k-way merge instead of concat + sort; temporary files go to --tmp_dir
+    1.2.0: Normalize, sort and coalesce the regions before extraction; extract them concurrently (--threads)
+    1.1.0: Extract regions in-process with bigwig.py; the UCSC tools are an optional fallback (--ucsc)
 
 """
 
@@ -17,10 +23,18 @@ import logging
 import subprocess
 import os
 import re
-import uuid
+import heapq
+import bisect
 import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import fasta_index
+import bigwig
+import instrument
 
-__version__ = '1.0.0'
+__version__ = '1.6.0'
 
 # logger
 logger = logging.getLogger(__name__)
@@ -30,57 +44,104 @@ if not logger.handlers:
     lh.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
     logger.addHandler(lh)
 
+SUMMARY_STATS = ['mean', 'max', 'min', 'coverage', 'sum']
+# --summary reads a zoom level when its records are at most 1/ZOOM_RESOLUTION of the bin width;
+# only the zoom records entirely inside a bin are used, its edges are read at full resolution
+ZOOM_RESOLUTION = 2
 
-def fasta_file_sequence_length(fasta_file):
-    # get the length of the sequence in the fasta_file
-    # sequence_length = {'SequenceID': {'length': Sequence_length, 'state': True}
-    # True: finished; False: processing
-    sequence_length = dict()
-    sequence_id = None
-    with open(fasta_file, 'rb') as fasta_file_f:
-        for line in fasta_file_f:
-            line = line.strip()
-            if len(line) != 0:
-                if line[0] == '>':
-                    lines = line.split(' ')
-                    if sequence_id == None:
-                        # the first sequence
-                        sequence_id = lines[0][1:]
-                    elif sequence_id != lines[0][1:]:
-                        # next sequence
-                        sequence_length[sequence_id]['state'] = True
-                        sequence_id = lines[0][1:]
-                    if sequence_id not in sequence_length:
-                        sequence_length[sequence_id] = {
-                            'length': 0,
-                            'state': False
-                        }
-                    else:
-                        if sequence_length[sequence_id]['state'] == True:
-                            logger.warning('Duplicate ID found! %s' % (sequence_id))
-                else:
-                    sequence_length[sequence_id]['length'] += len(line)
+
+def fasta_file_sequence_length(fasta_file, threads=1):
+    # get the length of the sequence in the fasta_file from its .fai index
+    # the index is built in one pass and saved next to the fasta_file when it is missing or out of date
+    # sequence_length = {'SequenceID': Sequence_length}
+    return fasta_index.sequence_lengths(fasta_file, threads=threads)
+
+
+def bigwig_file_sequence_length(bigwig_file):
+    # get the chrom sizes from the chromosome B+ tree in the bigwig header
+    # sequence_length = {'SequenceID': Sequence_length}
+    try:
+        with bigwig.BigWigReader(bigwig_file) as reader:
+            return reader.chrom_sizes()
+    except (bigwig.BigWigError, IOError, OSError) as e:
+        logger.error('%s: Failed to read the chrom sizes from the bigwig header (%s)' % (bigwig_file, e))
+        sys.exit(1)
+
+
+def chrom_sizes(input_bigwig, fasta_file=None, cache_dir=None, use_cache=True, threads=1):
+    # chrom sizes of the genome fasta_file when given (from the cache when the FASTA is unchanged),
+    # otherwise from the header of the input bigwig
+    if fasta_file is None:
+        return bigwig_file_sequence_length(input_bigwig)
+    if not use_cache:
+        return fasta_file_sequence_length(fasta_file, threads)
+    sequence_length, cached = fasta_index.cached_sequence_lengths(fasta_file, cache_dir, threads)
+    if cached:
+        logger.info('%s: Chrom sizes loaded from the cache' % (fasta_file))
     return sequence_length
 
 
-if __name__ == '__main__':
-    import argparse
-    from textwrap import dedent
-    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=dedent("""\
+def parse_region(line):
+    # return (RNAME, STARTPOS, ENDPOS), STARTPOS and ENDPOS are None when missing
+    # pattern: RNAME[:START[-END]]
+    match = re.match(r'([^\s:]+)(?::(\d+)(?:-(\d+))?)?', line)
+    if not bool(match):
+        return None
+    chrom, start, end = match.groups()
+    return chrom, None if start is None else int(start), None if end is None else int(end)
 
-    Extract portions of bigwig data from a bigwig file. The specific regions can be specified as: RNAME[:STARTPOS[-ENDPOS]].
 
-    Quick start:
-    %(prog)s -in_b input.bigwig -regions region.txt -f genome.fasta -out_b output.bigwig
-    """))
-    # argument
-    parser.add_argument('-in_b', '--input_bigwig', type=str, help='Input Bigwig file', required=True)
-    parser.add_argument('-regions', '--regions', type=str, help='Input a file that contain the list of the specific regions. Regions can be specified as: RNAME[:STARTPOS[-ENDPOS]]', required=True)
-    parser.add_argument('-f', '--fasta', type=str, help='The genome fasta')
-    parser.add_argument('-out_b', '--output_bigwig', type=str, help='Output Bigwig file', required=True)
-    parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
+def read_regions(regions_file):
+    regions_list = list()
+    with open(regions_file, 'r') as scaffold_f:
+        for line in scaffold_f:
+            line = line.strip()
+            if line:
+                regions = parse_region(line)
+                if regions is None:
+                    logger.warning('Failed to recognize the region: %s' % (line))
+                    continue
+                regions_list.append((line, regions))
+    return regions_list
 
-    args = parser.parse_args()
+
+def normalize_region(line, chrom, start, end, sequence_length):
+    # clip RNAME / RNAME:START / RNAME:START-END to the chrom sizes
+    # return (start, end), None when the region is skipped
+    if chrom not in sequence_length:
+        logger.warning('%s is not in the chrom sizes, skip the region: %s' % (chrom, line))
+        return None
+    if start is None:
+        start = 0
+    if end is None or end > sequence_length[chrom]:
+        end = sequence_length[chrom]
+    if start >= end:
+        logger.warning('Empty region: %s' % (line))
+        return None
+    return start, end
+
+
+def plan_regions(regions_list, sequence_length):
+    # normalize RNAME / RNAME:START / RNAME:START-END against the chrom sizes, sort the regions
+    # and coalesce the overlapping (or adjacent) ones, so every base is extracted only once
+    # plan = [(chrom, start, end)], sorted by chrom and start
+    regions = list()
+    for line, (chrom, start, end) in regions_list:
+        region = normalize_region(line, chrom, start, end, sequence_length)
+        if region is not None:
+            regions.append((chrom.encode('utf-8'), region[0], region[1]))
+    regions.sort()
+    plan = list()
+    for chrom, start, end in regions:
+        chrom = chrom.decode('utf-8')
+        if plan and plan[-1][0] == chrom and start <= plan[-1][2]:
+            plan[-1] = (chrom, plan[-1][1], max(end, plan[-1][2]))
+        else:
+            plan.append((chrom, start, end))
+    return plan
+
+
+def check_ucsc_tools():
     # check if bigwigToBedGraph and bedGraphToBigwig is in the path
     missing_tool = False
     try:
@@ -100,71 +161,380 @@ if __name__ == '__main__':
     if missing_tool:
         sys.exit()
 
-    rm_tmp_list = []
-    temp_dir = os.path.dirname(args.input_bigwig)
-
-    # generate chrom.size file
-    chrom = os.path.join(temp_dir, 'chrom.size')
-    if os.path.exists(chrom):
-        chrom += str(uuid.uuid1())
-    rm_tmp_list.append(chrom)
-    with open(chrom, 'w') as chrom_f:
-        sequence_length = fasta_file_sequence_length(args.fasta)
-        for scaffold in sequence_length:
-            chrom_f.write(scaffold + '\t' + str(sequence_length[scaffold]['length']) + '\n')
-    # get bedGraph subset
-    Subset_bedGraph = list()
-    with open(args.regions, 'r') as scaffold_f:
-        for line in scaffold_f:
-            line = line.strip()
-            if line:
-                # pattern: RNAME:START-END
-                match = re.match(r'(\w+):(\d+)-(\d+)', line)
-                if not bool(match):
-                    # pattern: RNAME:START
-                    match = re.match(r'(\w+):(\d+)', line)
-                    if not bool(match):
-                        # pattern: RNAME
-                        match = re.match(r'(\w+)', line)
-                        if not bool(match):
-                            logger.warning('Failed to recognize the region: %s' % (line))
-                            continue
-                regions = match.groups()
-                # chr1:123-456
-                output_file = os.path.join(temp_dir, line + '.bedgraph' )
-                if os.path.exists(output_file):
-                    output_file += str(uuid.uuid1())
-                rm_tmp_list.append(output_file)
-                Subset_bedGraph.append(output_file)
-                cmd = ['bigWigToBedGraph', args.input_bigwig, output_file]
-                for idx, value in enumerate(regions):
-                    if idx == 0:
-                        cmd.append('-chrom=' + regions[0])
-                    elif idx == 1:
-                        cmd.append('-start=' + regions[1])
-                    elif idx == 2:
-                        cmd.append('-end=' + regions[2])
-                subprocess.Popen(cmd).wait()
-    merge_file = os.path.join(temp_dir, 'merge.bedgraph')
-    if os.path.exists(merge_file):
-        merge_file += str(uuid.uuid1())
-    rm_tmp_list.append(merge_file)
-    # merge all the bedgraph subset
-    with open(merge_file, 'wb') as merge_f:
-        for f in Subset_bedGraph:
-            with open(f, 'rb') as fd:
-                # data read in chunks to avoid reading big file into memory
-                shutil.copyfileobj(fd, merge_f)
-    sort_file = os.path.join(temp_dir, 'merge_sort.bedgraph')
-    if os.path.exists(sort_file):
-        sort_file += str(uuid.uuid1())
-    rm_tmp_list.append(sort_file)
-    tmp_out = open(sort_file, 'w')
-    subprocess.Popen(['sort', '-k1,1', '-k2,2n', merge_file], stdout=tmp_out).wait()
-    tmp_out.close()
-    # convert bedGraph to bigwig
-    subprocess.Popen(['bedGraphToBigWig', sort_file, chrom, args.output_bigwig]).wait()
-    # remove all the tmp file
-    for rmfile in rm_tmp_list:
-        if os.path.exists(rmfile):
-            os.remove(rmfile)
+
+def merge_sorted_streams(streams):
+    # Streaming heap-based k-way merge.
+    # streams = [(lower_bound_key, open_stream)], open_stream() returns an iterable of (key, item) sorted by key.
+    # A stream is only opened when its lower bound reaches the top of the heap, so with the
+    # sorted, coalesced plan only a few streams are open at the same time.
+    heap = [(lower_bound_key, idx, False) for idx, (lower_bound_key, open_stream) in enumerate(streams)]
+    heapq.heapify(heap)
+    iterators = dict()
+    items = dict()
+    while heap:
+        key, idx, opened = heapq.heappop(heap)
+        if opened:
+            yield items.pop(idx)
+            iterator = iterators[idx]
+        else:
+            iterator = iter(streams[idx][1]())
+            iterators[idx] = iterator
+        for next_key, item in iterator:
+            items[idx] = item
+            heapq.heappush(heap, (next_key, idx, True))
+            break
+        else:
+            del iterators[idx]
+
+
+def extract_intervals(input_bigwig, plan, threads=1):
+    # yield (chrom, start, end, value) of all the regions of the plan, in plan order
+    # the regions are read in threads, but reading is a small part of the run time and the
+    # writer (section encoding, zoom levels) consumes the intervals in this thread
+    # the plan is sorted and coalesced, so the regions only need to be joined in order; at most
+    # threads * 2 regions are read ahead, so the memory does not grow with the number of regions
+    # every worker thread reads through its own open file
+    local = threading.local()
+    readers = list()
+
+    def extract_region(region):
+        reader = getattr(local, 'reader', None)
+        if reader is None:
+            reader = bigwig.BigWigReader(input_bigwig)
+            local.reader = reader
+            readers.append(reader)
+        return reader.intervals(*region)
+
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            futures = deque()
+            regions = iter(plan)
+            for region in regions:
+                futures.append((region[0], executor.submit(extract_region, region)))
+                if len(futures) >= threads * 2:
+                    break
+            while futures:
+                chrom, future = futures.popleft()
+                intervals = future.result()
+                for region in regions:
+                    futures.append((region[0], executor.submit(extract_region, region)))
+                    break
+                for start, end, value in intervals:
+                    yield chrom, start, end, value
+    finally:
+        for reader in readers:
+            reader.close()
+
+
+def extract_bigwig(input_bigwig, plan, sequence_length, output_bigwig, threads=1):
+    # extract the regions from the input bigwig and feed the merged intervals into the bigwig writer
+    try:
+        bigwig.write_bigwig(output_bigwig, sequence_length, extract_intervals(input_bigwig, plan, threads))
+    except bigwig.BigWigError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+
+def read_bedgraph(bedgraph_file, chrom_rank):
+    # yield ((chrom_rank, start), line) of a sorted bedGraph file
+    with open(bedgraph_file, 'r') as bedgraph_f:
+        for line in bedgraph_f:
+            tokens = line.split('\t', 3)
+            if len(tokens) == 4:
+                yield (chrom_rank[tokens[0]], int(tokens[1])), line
+
+
+def extract_bigwig_ucsc(input_bigwig, plan, sequence_length, output_bigwig, threads=1, tmp_dir=None):
+    # extract the regions with bigWigToBedGraph and convert them back with bedGraphToBigWig
+    # temporary files are written to a scratch directory under tmp_dir ($TMPDIR by default)
+    check_ucsc_tools()
+    temp_dir = tempfile.mkdtemp(prefix='bigwig_extract.', dir=tmp_dir)
+    try:
+        # generate chrom.size file
+        chrom = os.path.join(temp_dir, 'chrom.size')
+        with instrument.stage('chrom_size_file'):
+            with open(chrom, 'w') as chrom_f:
+                for scaffold in sequence_length:
+                    chrom_f.write(scaffold + '\t' + str(sequence_length[scaffold]) + '\n')
+        # get bedGraph subset
+        chrom_rank = dict()
+        Subset_bedGraph = list()
+        cmds = list()
+        for idx, (region_chrom, start, end) in enumerate(plan):
+            chrom_rank.setdefault(region_chrom, len(chrom_rank))
+            output_file = os.path.join(temp_dir, 'region_%d.bedgraph' % (idx))
+            Subset_bedGraph.append(output_file)
+            cmds.append(['bigWigToBedGraph', input_bigwig, output_file, '-chrom=' + region_chrom, '-start=' + str(start), '-end=' + str(end)])
+        with instrument.stage('bigWigToBedGraph') as stage:
+            with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+                for cmd, returncode in zip(cmds, executor.map(lambda cmd: subprocess.Popen(cmd).wait(), cmds)):
+                    if returncode != 0:
+                        logger.error('Failed to run: %s' % (' '.join(cmd)))
+                        sys.exit(1)
+            stage.add(records=len(cmds))
+        # merge all the sorted bedgraph subsets by chrom and start, no separate sort pass is needed
+        streams = list()
+        for (region_chrom, start, end), output_file in zip(plan, Subset_bedGraph):
+            streams.append(((chrom_rank[region_chrom], start), lambda output_file=output_file: read_bedgraph(output_file, chrom_rank)))
+        sort_file = os.path.join(temp_dir, 'merge_sort.bedgraph')
+        with instrument.stage('merge') as stage:
+            line_count = 0
+            with open(sort_file, 'w') as sort_f:
+                for line in merge_sorted_streams(streams):
+                    sort_f.write(line)
+                    line_count += 1
+            stage.add(records=line_count)
+        # convert bedGraph to bigwig
+        with instrument.stage('bedGraphToBigWig'):
+            returncode = subprocess.Popen(['bedGraphToBigWig', sort_file, chrom, output_bigwig]).wait()
+        if returncode != 0:
+            logger.error('Failed to run bedGraphToBigWig')
+            sys.exit(1)
+    finally:
+        # remove all the tmp file
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def summary_regions(regions_list, sequence_length):
+    # summary = [(line, chrom, start, end)] in input order, the regions are not coalesced
+    summary = list()
+    for line, (chrom, start, end) in regions_list:
+        region = normalize_region(line, chrom, start, end, sequence_length)
+        if region is not None:
+            summary.append((line, chrom, region[0], region[1]))
+    return summary
+
+
+def region_bins(start, end, bin_size=None):
+    # [(bin_start, bin_end)] of bin_size bases (the last bin may be shorter), the region itself without bin_size
+    if not bin_size:
+        return [(start, end)]
+    return [(bin_start, min(bin_start + bin_size, end)) for bin_start in range(start, end, bin_size)]
+
+
+def choose_zoom_level(reader, resolution):
+    # index of the coarsest zoom level with records of at most resolution / ZOOM_RESOLUTION bases,
+    # None when the full resolution data is needed
+    best = None
+    for idx, zoom_level in enumerate(reader.zoom_levels):
+        if zoom_level['reduction'] * ZOOM_RESOLUTION <= resolution:
+            if best is None or zoom_level['reduction'] > reader.zoom_levels[best]['reduction']:
+                best = idx
+    return best
+
+
+def summarize_intervals(intervals, bins):
+    # [[covered bases, min, max, sum]] of every bin from the full resolution data:
+    # intervals = [(start, end, value)] sorted and clipped to the bins, bins = region_bins() of one region
+    if len(bins) == 1:
+        if not intervals:
+            return [[0.0, None, None, 0.0]]
+        values = [value for start, end, value in intervals]
+        return [[float(sum(end - start for start, end, value in intervals)), min(values), max(values), sum(value * (end - start) for start, end, value in intervals)]]
+    summary = [[0.0, None, None, 0.0] for _ in bins]
+    region_start = bins[0][0]
+    bin_size = bins[0][1] - region_start
+    for start, end, value in intervals:
+        idx = (start - region_start) // bin_size
+        while start < end:
+            bin_end = min(region_start + (idx + 1) * bin_size, end)
+            bin_summary = summary[idx]
+            bin_summary[0] += bin_end - start
+            bin_summary[3] += value * (bin_end - start)
+            if bin_summary[1] is None or value < bin_summary[1]:
+                bin_summary[1] = value
+            if bin_summary[2] is None or value > bin_summary[2]:
+                bin_summary[2] = value
+            start = bin_end
+            idx += 1
+    return summary
+
+
+def summary_values(bin_start, bin_end, bin_summary, stats):
+    # values of the requested SUMMARY_STATS, None when the bin has no data
+    covered, min_value, max_value, sum_data = bin_summary
+    values = {
+        'mean': sum_data / covered if covered else None,
+        'max': max_value,
+        'min': min_value,
+        'coverage': covered / (bin_end - bin_start),
+        'sum': sum_data
+    }
+    return [values[stat] for stat in stats]
+
+
+def zoom_bin_summary(reader, chrom, bin_start, bin_end, records, record_starts):
+    # [covered bases, min, max, sum] of one bin from the zoom records lying entirely inside it;
+    # the edges of the bin outside those records are read at full resolution, so the result is
+    # the same as summarize_intervals() (zoom records of one level do not overlap)
+    # records = zoom records [(start, end, valid_count, min, max, sum, sum_squares)] sorted by start
+    inside = list()
+    idx = bisect.bisect_left(record_starts, bin_start)
+    while idx < len(records) and records[idx][0] < bin_end:
+        if records[idx][1] <= bin_end:
+            inside.append(records[idx])
+        idx += 1
+    if not inside:
+        return summarize_intervals(reader.intervals(chrom, bin_start, bin_end), [(bin_start, bin_end)])[0]
+    edges = reader.intervals(chrom, bin_start, inside[0][0]) + reader.intervals(chrom, inside[-1][1], bin_end)
+    bin_summary = summarize_intervals(edges, [(bin_start, bin_end)])[0]
+    for record_start, record_end, valid_count, min_value, max_value, sum_data, sum_squares in inside:
+        if valid_count == 0:
+            continue
+        bin_summary[0] += valid_count
+        bin_summary[1] = min_value if bin_summary[1] is None else min(bin_summary[1], min_value)
+        bin_summary[2] = max_value if bin_summary[2] is None else max(bin_summary[2], max_value)
+        bin_summary[3] += sum_data
+    return bin_summary
+
+
+def summarize_region(reader, region, bin_size=None, exact=False):
+    # return [(bin_start, bin_end, [covered bases, min, max, sum])] of a region
+    # every bin uses the zoom level chosen for its own width (the last bin may be shorter)
+    line, chrom, start, end = region
+    bins = region_bins(start, end, bin_size)
+    if exact:
+        summary = summarize_intervals(reader.intervals(chrom, start, end), bins)
+    else:
+        # zoom_records = {zoom_idx: (records of the region, their starts)}
+        zoom_records = dict()
+        summary = list()
+        for bin_start, bin_end in bins:
+            zoom_idx = choose_zoom_level(reader, bin_end - bin_start)
+            if zoom_idx is None:
+                summary.append(summarize_intervals(reader.intervals(chrom, bin_start, bin_end), [(bin_start, bin_end)])[0])
+                continue
+            if zoom_idx not in zoom_records:
+                records = reader.zoom_records(zoom_idx, chrom, start, end)
+                zoom_records[zoom_idx] = (records, [record[0] for record in records])
+            records, record_starts = zoom_records[zoom_idx]
+            summary.append(zoom_bin_summary(reader, chrom, bin_start, bin_end, records, record_starts))
+    return [(bin_start, bin_end, bin_summary) for (bin_start, bin_end), bin_summary in zip(bins, summary)]
+
+
+def summarize_regions(input_bigwig, regions, bin_size=None, exact=False, threads=1):
+    # summarize all the regions, read in (chrom, start) order so neighbouring regions share the
+    # decoded blocks; return the summaries in input order
+    order = sorted(range(len(regions)), key=lambda idx: (regions[idx][1], regions[idx][2]))
+    local = threading.local()
+    readers = list()
+
+    def summarize(idx):
+        reader = getattr(local, 'reader', None)
+        if reader is None:
+            reader = bigwig.BigWigReader(input_bigwig)
+            local.reader = reader
+            readers.append(reader)
+        return summarize_region(reader, regions[idx], bin_size, exact)
+
+    summaries = [None for _ in regions]
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for idx, summary in zip(order, executor.map(summarize, order)):
+                summaries[idx] = summary
+    except bigwig.BigWigError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    finally:
+        for reader in readers:
+            reader.close()
+    return summaries
+
+
+def write_summary(summary_file, regions, summaries, stats):
+    # TSV: one line per region (or bin), NA when a bin has no data
+    # .npy: a float64 matrix of the same rows (NaN when a bin has no data) and the rows in
+    # [summary].rows.tsv
+    header = ['#Region', 'Chrom', 'Start', 'End']
+    if summary_file.endswith('.npy'):
+        try:
+            import numpy
+        except ImportError:
+            logger.error('numpy is required to write a .npy summary')
+            sys.exit(1)
+        rows_file = os.path.splitext(summary_file)[0] + '.rows.tsv'
+        matrix = list()
+        with open(rows_file, 'w') as rows_f:
+            rows_f.write('\t'.join(header) + '\n')
+            for (line, chrom, start, end), summary in zip(regions, summaries):
+                for bin_start, bin_end, bin_summary in summary:
+                    rows_f.write('\t'.join([line, chrom, str(bin_start), str(bin_end)]) + '\n')
+                    matrix.append([numpy.nan if value is None else value for value in summary_values(bin_start, bin_end, bin_summary, stats)])
+        numpy.save(summary_file, numpy.array(matrix, dtype=numpy.float64).reshape(len(matrix), len(stats)))
+        return
+    with open(summary_file, 'w') as out_f:
+        out_f.write('\t'.join(header + stats) + '\n')
+        for (line, chrom, start, end), summary in zip(regions, summaries):
+            for bin_start, bin_end, bin_summary in summary:
+                values = ['NA' if value is None else '%.8g' % (value) for value in summary_values(bin_start, bin_end, bin_summary, stats)]
+                out_f.write('\t'.join([line, chrom, str(bin_start), str(bin_end)] + values) + '\n')
+
+
+def main():
+    import argparse
+    from textwrap import dedent
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=dedent("""\
+
+    Extract portions of bigwig data from a bigwig file. The specific regions can be specified as: RNAME[:STARTPOS[-ENDPOS]].
+
+    Quick start:
+    %(prog)s -in_b input.bigwig -regions region.txt -out_b output.bigwig
+    %(prog)s -in_b input.bigwig -regions region.txt -f genome.fasta -out_b output.bigwig
+
+    Summary statistics of every region (or of every --bin_size bin of the regions) instead of a bigwig:
+    %(prog)s -in_b input.bigwig -regions region.txt -summary summary.tsv -bin 1000
+    """))
+    # argument
+    parser.add_argument('-in_b', '--input_bigwig', type=str, help='Input Bigwig file', required=True)
+    parser.add_argument('-regions', '--regions', type=str, help='Input a file that contain the list of the specific regions. Regions can be specified as: RNAME[:STARTPOS[-ENDPOS]]', required=True)
+    parser.add_argument('-f', '--fasta', type=str, help='The genome fasta (plain, gzip or BGZF) for the chrom sizes, default: the chrom sizes in the input bigwig header')
+    parser.add_argument('-cache', '--cache_dir', type=str, help='Directory of the chrom size cache, default: $XDG_CACHE_HOME/genomic_data_processing/chrom_sizes or ~/.cache/...')
+    parser.add_argument('-no_cache', '--no_cache', action='store_true', help='Do not read or write the chrom size cache')
+    parser.add_argument('-out_b', '--output_bigwig', type=str, help='Output Bigwig file')
+    parser.add_argument('-summary', '--summary', type=str, help='Write the summary statistics of every region (or bin) in the input order, as TSV or, for a .npy file name, as a NumPy matrix with the rows in [summary].rows.tsv')
+    parser.add_argument('-stat', '--summary_stats', nargs='+', choices=SUMMARY_STATS, help='Statistics of --summary, default: %s' % (' '.join(SUMMARY_STATS)), default=SUMMARY_STATS)
+    parser.add_argument('-bin', '--bin_size', type=int, help='Summarize fixed-width bins of [bin_size] bases inside every region')
+    parser.add_argument('-exact', '--exact', action='store_true', help='Summarize the full resolution data only. By default the zoom records lying entirely inside a bin are used (with the bin edges read at full resolution) when their resolution is at least twice the bin width')
+    parser.add_argument('-t', '--threads', type=int, help='Number of threads for the UCSC tools (-ucsc) and for BGZF decompression of -f. The built-in reader and writer run Python code under the GIL, so more threads do not make them faster, default: 1', default=1)
+    parser.add_argument('-tmp', '--tmp_dir', type=str, help='Scratch directory for temporary files, default: $TMPDIR or /tmp')
+    parser.add_argument('-ucsc', '--ucsc', action='store_true', help='Use bigWigToBedGraph and bedGraphToBigWig from the $PATH instead of the built-in bigWig reader/writer')
+    instrument.add_arguments(parser)
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
+
+    args = parser.parse_args()
+    instrument.start('bigwig_extract', __version__, args)
+    if not args.output_bigwig and not args.summary:
+        logger.error('Specify the output bigwig (-out_b) and/or the summary file (-summary)')
+        sys.exit(1)
+    if args.bin_size is not None and args.bin_size < 1:
+        logger.error('Option --bin_size requires a positive integer: %d' % (args.bin_size))
+        sys.exit(1)
+    if args.threads < 1:
+        logger.error('Option --threads requires a positive integer: %d' % (args.threads))
+        sys.exit(1)
+
+    with instrument.stage('chrom_sizes', input_file=args.fasta or args.input_bigwig) as stage:
+        sequence_length = chrom_sizes(args.input_bigwig, args.fasta, args.cache_dir, not args.no_cache, args.threads)
+        stage.add(records=len(sequence_length))
+    regions_list = read_regions(args.regions)
+    if args.summary:
+        with instrument.stage('summary', input_file=args.input_bigwig) as stage:
+            regions = summary_regions(regions_list, sequence_length)
+            summaries = summarize_regions(args.input_bigwig, regions, args.bin_size, args.exact, args.threads)
+            write_summary(args.summary, regions, summaries, args.summary_stats)
+            stage.add(records=sum(len(summary) for summary in summaries))
+    if not args.output_bigwig:
+        return
+    with instrument.stage('plan', input_file=args.regions) as stage:
+        plan = plan_regions(regions_list, sequence_length)
+        stage.add(records=len(plan))
+    with instrument.stage('extract', input_file=args.input_bigwig) as stage:
+        if args.ucsc:
+            extract_bigwig_ucsc(args.input_bigwig, plan, sequence_length, args.output_bigwig, args.threads, args.tmp_dir)
+        else:
+            extract_bigwig(args.input_bigwig, plan, sequence_length, args.output_bigwig, args.threads)
+        stage.add(records=len(plan))
+
+
+if __name__ == '__main__':
+    main()
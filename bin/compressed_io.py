@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# Compressed I/O for the FASTA tools.
+#
+# BGZF (blocked gzip, as written by bgzip/samtools) is a series of independent gzip members of
+# at most 64 KB, so the blocks can be inflated and deflated by several threads at once
+# (zlib releases the GIL). Plain gzip input is streamed through the gzip module.
+
+import io
+import os
+import sys
+import zlib
+import gzip
+import struct
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+__version__ = '1.0.0'
+
+# logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    lh = logging.StreamHandler()
+    lh.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
+    logger.addHandler(lh)
+
+GZIP_MAGIC = b'\x1f\x8b\x08'
+# uncompressed bytes per BGZF block, the same as htslib
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_EOF = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+
+def is_gzip(input_file):
+    with open(input_file, 'rb') as in_f:
+        file_start = in_f.read(len(GZIP_MAGIC))
+    return file_start.startswith(GZIP_MAGIC)
+
+
+def is_bgzf(input_file):
+    # gzip header with FEXTRA and a 'BC' subfield
+    with open(input_file, 'rb') as in_f:
+        header = in_f.read(18)
+    return len(header) == 18 and header[:4] == b'\x1f\x8b\x08\x04' and header[12:16] == b'BC\x02\x00'
+
+
+def inflate_block(block):
+    # block = (compressed data, crc32, uncompressed size)
+    cdata, crc, size = block
+    data = zlib.decompress(cdata, -15)
+    if len(data) != size or zlib.crc32(data) != crc:
+        raise IOError('BGZF block failed the CRC/size check')
+    return data
+
+
+def deflate_block(data, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<BBBBIBBHBBHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25)
+    return header + cdata + struct.pack('<II', zlib.crc32(data), len(data))
+
+
+class BgzfReader(io.RawIOBase):
+    # read a BGZF file, blocks are inflated by a thread pool and returned in file order
+    def __init__(self, input_file, threads=1):
+        self.input_file = input_file
+        self.raw = open(input_file, 'rb')
+        self.threads = max(1, threads)
+        self.executor = ThreadPoolExecutor(max_workers=self.threads) if self.threads > 1 else None
+        self.blocks = self._inflated_blocks()
+        self.buffer = b''
+        self.buffer_pos = 0
+
+    def readable(self):
+        return True
+
+    def _read_raw_block(self):
+        header = self.raw.read(12)
+        if not header:
+            return None
+        if len(header) < 12 or header[:3] != GZIP_MAGIC or not header[3] & 4:
+            raise IOError('%s: Not a BGZF file' % (self.input_file))
+        xlen = struct.unpack('<H', header[10:12])[0]
+        extra = self.raw.read(xlen)
+        block_size = None
+        pos = 0
+        while pos + 4 <= len(extra):
+            si1, si2, slen = struct.unpack('<BBH', extra[pos:pos + 4])
+            if si1 == 66 and si2 == 67 and slen == 2:
+                block_size = struct.unpack('<H', extra[pos + 4:pos + 6])[0] + 1
+            pos += 4 + slen
+        if block_size is None:
+            raise IOError('%s: BGZF block without a BC subfield' % (self.input_file))
+        rest = self.raw.read(block_size - 12 - xlen)
+        if len(rest) != block_size - 12 - xlen:
+            raise IOError('%s: Truncated BGZF block' % (self.input_file))
+        crc, size = struct.unpack('<II', rest[-8:])
+        return rest[:-8], crc, size
+
+    def _inflated_blocks(self):
+        if self.executor is None:
+            while True:
+                block = self._read_raw_block()
+                if block is None:
+                    return
+                yield inflate_block(block)
+        # keep a few blocks per thread in flight
+        pending = deque()
+        while True:
+            block = self._read_raw_block()
+            if block is None:
+                break
+            pending.append(self.executor.submit(inflate_block, block))
+            if len(pending) >= self.threads * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def readinto(self, b):
+        while self.buffer_pos >= len(self.buffer):
+            self.buffer = next(self.blocks, None)
+            self.buffer_pos = 0
+            if self.buffer is None:
+                self.buffer = b''
+                return 0
+        size = min(len(b), len(self.buffer) - self.buffer_pos)
+        b[:size] = self.buffer[self.buffer_pos:self.buffer_pos + size]
+        self.buffer_pos += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+            self.raw.close()
+        super(BgzfReader, self).close()
+
+
+class BgzfWriter(io.RawIOBase):
+    # write a BGZF file, blocks are deflated by a thread pool and written in order
+    def __init__(self, output_file, threads=1, level=6):
+        self.raw = open(output_file, 'wb')
+        self.threads = max(1, threads)
+        self.level = level
+        self.executor = ThreadPoolExecutor(max_workers=self.threads) if self.threads > 1 else None
+        self.pending = deque()
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def _submit(self, data):
+        if self.executor is None:
+            self.raw.write(deflate_block(data, self.level))
+            return
+        self.pending.append(self.executor.submit(deflate_block, data, self.level))
+        while len(self.pending) >= self.threads * 4:
+            self.raw.write(self.pending.popleft().result())
+
+    def write(self, b):
+        self.buffer += b
+        if len(self.buffer) >= BGZF_BLOCK_SIZE:
+            full = len(self.buffer) - len(self.buffer) % BGZF_BLOCK_SIZE
+            for start in range(0, full, BGZF_BLOCK_SIZE):
+                self._submit(bytes(self.buffer[start:start + BGZF_BLOCK_SIZE]))
+            del self.buffer[:full]
+        return len(b)
+
+    def close(self):
+        if not self.closed:
+            if self.buffer:
+                self._submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            while self.pending:
+                self.raw.write(self.pending.popleft().result())
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+            self.raw.write(BGZF_EOF)
+            self.raw.close()
+        super(BgzfWriter, self).close()
+
+
+def open_input(input_file, threads=1, text=False):
+    # open plain, gzip or BGZF input as a binary (or text) stream
+    if not os.path.exists(input_file):
+        logger.error('%s: No Such file or directory' % (input_file))
+        sys.exit(1)
+    if is_bgzf(input_file):
+        in_f = io.BufferedReader(BgzfReader(input_file, threads), buffer_size=1 << 20)
+    elif is_gzip(input_file):
+        in_f = gzip.open(input_file, 'rb')
+    else:
+        in_f = open(input_file, 'rb')
+    if text:
+        return io.TextIOWrapper(in_f, encoding='utf-8')
+    return in_f
+
+
+def compressed_file_name(output_file):
+    if output_file.endswith('.gz'):
+        return output_file
+    return output_file + '.gz'
+
+
+def open_output(output_file, compress=False, threads=1, text=True):
+    # open plain or BGZF output as a text (or binary) stream
+    if compress:
+        out_f = io.BufferedWriter(BgzfWriter(output_file, threads), buffer_size=1 << 20)
+    else:
+        out_f = open(output_file, 'wb')
+    if text:
+        return io.TextIOWrapper(out_f, encoding='utf-8', newline='\n')
+    return out_f
@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+# FASTA parsing and rewriting shared by FilterFastaByLength.py, modification_fasta_ID.py and
+# fasta_pipeline.py.
+#
+# Two engines:
+#   run_pipeline()  record by record: length filter, reserved character cleaning, ID
+#                   translation and the length (chrom size) report in one streaming pass
+#   rewrite_fasta() block by block: ID translation only, sequence bytes are passed through
+
+import re
+import sys
+from array import array
+import logging
+import compressed_io
+
+__version__ = '1.0.0'
+
+# logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    lh = logging.StreamHandler()
+    lh.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
+    logger.addHandler(lh)
+
+# default ID translation: digits to letters
+transfor_dict = {
+    '1': 'A',
+    '2': 'B',
+    '3': 'C',
+    '4': 'D',
+    '5': 'E',
+    '6': 'F',
+    '7': 'G',
+    '8': 'I',
+    '9': 'J',
+    '0': 'K'
+}
+
+# Linux reserved characters
+RESERVED_CHAR = set(['/', '>', '<', ':', '&', '\'', '\"', '\\'])
+
+# a sequence segment that can be written unchanged has no whitespace to strip
+DIRTY_SEGMENT = re.compile(b'[ \\t\\r\\x0b\\x0c]')
+
+
+def fasta_iter(fasta_file, threads=1):
+    # yield (fasta_id, sequence_list) one record at a time, so memory is bounded by the largest record
+    # plain, gzip and BGZF (decompressed by several threads) input is supported
+    fasta_id = None
+    sequence_list = list()
+    with compressed_io.open_input(fasta_file, threads) as in_f:
+        for line in in_f:
+            line = line.decode('utf-8').strip()
+            if len(line) > 0:
+                if line[0] == '>':
+                    if fasta_id is not None:
+                        yield fasta_id, sequence_list
+                    fasta_id = line[1:]
+                    sequence_list = list()
+                elif fasta_id is None:
+                    logger.error('%s: Sequence found before the first FASTA header' % (fasta_file))
+                    sys.exit(1)
+                else:
+                    sequence_list.append(line)
+    if fasta_id is not None:
+        yield fasta_id, sequence_list
+
+
+def fasta_reader(fasta_file):
+    fasta_dict = dict()
+    for fasta_id, sequence_list in fasta_iter(fasta_file):
+        fasta_dict[fasta_id] = {
+            'sequence_list': sequence_list,
+            'seqs': ''.join(sequence_list)
+        }
+    return fasta_dict
+
+
+def replace_reserved_char(fasta_id):
+    new_fasta_id = str()
+    fasta_ids = fasta_id.split(' ')
+    for c in fasta_ids[0]:
+        if c in RESERVED_CHAR:
+            new_c = '_'
+        else:
+            new_c = c
+        new_fasta_id += new_c
+    return new_fasta_id
+
+
+def load_mapping(mapping_file):
+    # mapping file: OLD<TAB>NEW per line, lines starting with '#' are comments
+    mapping = dict()
+    with open(mapping_file, 'r') as in_f:
+        for line in in_f:
+            line = line.rstrip('\r\n')
+            if line and line[0] != '#':
+                tokens = line.split('\t')
+                if len(tokens) != 2 or not tokens[0]:
+                    logger.error('%s: Expect two tab-separated columns: %s' % (mapping_file, line))
+                    sys.exit(1)
+                mapping[tokens[0]] = tokens[1]
+    return mapping
+
+
+def sub_rules(rules, fasta_id):
+    # rules = [(compiled pattern, replacement)]
+    # Replace the matches of several regular expressions in one left-to-right pass, like one
+    # alternation regex: the earliest match wins, at the same position the first rule wins.
+    # Every pattern is compiled on its own, so its groups and backreferences keep their numbers.
+    matches = [None for _ in rules]
+    new_id = list()
+    pos = 0
+    # position of the last empty match, the next match may start there but must not be empty
+    empty_at = -1
+    while pos <= len(fasta_id):
+        best = None
+        for idx, (pattern, replacement) in enumerate(rules):
+            # next match of every rule, searched again once the position passed its start;
+            # False when the rule has no more matches
+            match = matches[idx]
+            if match is None or (match and (match.start() < pos or match.end() == empty_at)):
+                match = pattern.search(fasta_id, pos)
+                if match and match.end() == empty_at:
+                    match = pattern.search(fasta_id, pos + 1) if pos < len(fasta_id) else None
+                match = match or False
+                matches[idx] = match
+            if match and (best is None or match.start() < best.start()):
+                best = match
+                best_replacement = replacement
+        if best is None:
+            break
+        new_id.append(fasta_id[pos:best.start()])
+        new_id.append(best_replacement)
+        pos = best.end()
+        if best.start() == pos:
+            empty_at = pos
+    new_id.append(fasta_id[pos:])
+    return b''.join(new_id)
+
+
+def compile_rules(mapping, regex=False):
+    # Build one function rewriting an ID (bytes).
+    # Single character rules are compiled into a bytes.translate() table, anything else into one
+    # alternation regex (longest match first); with regex=True the keys are regular expressions,
+    # applied in one pass by sub_rules().
+    byte_mapping = dict((key.encode('utf-8'), value.encode('utf-8')) for key, value in mapping.items())
+    if not regex and all(len(key) == 1 and len(value) == 1 for key, value in byte_mapping.items()):
+        table = bytes.maketrans(b''.join(byte_mapping), b''.join(byte_mapping.values()))
+        return lambda fasta_id: fasta_id.translate(table)
+    if regex:
+        rules = [(re.compile(pattern), replacement) for pattern, replacement in byte_mapping.items()]
+        if len(rules) == 1:
+            pattern, replacement = rules[0]
+            return lambda fasta_id: pattern.sub(lambda match: replacement, fasta_id)
+        return lambda fasta_id: sub_rules(rules, fasta_id)
+    rules = re.compile(b'|'.join([re.escape(key) for key in sorted(byte_mapping, key=len, reverse=True)]))
+    return lambda fasta_id: rules.sub(lambda match: byte_mapping[match.group(0)], fasta_id)
+
+
+class DigestSet(object):
+    # A set of byte strings that only keeps a 64-bit digest of each one, in an open addressing
+    # table (array('Q'), at most half full): 16-32 bytes per key, 48 while the table grows,
+    # instead of 70-80 bytes for a 128-bit int in a set(). Two keys with the same digest are
+    # taken as the same key (for 1M keys the chance that any two do is about 3e-8).
+    def __init__(self, capacity=1 << 16):
+        self.table = array('Q', bytes(8 * capacity))
+        self.mask = capacity - 1
+        self.count = 0
+
+    def add(self, key):
+        # add key (bytes), return True if it was already in the set
+        # hash() of bytes is a 64-bit SipHash, the digests are only compared within this process
+        digest = hash(key) & 0xFFFFFFFFFFFFFFFF or 1
+        table = self.table
+        mask = self.mask
+        idx = digest & mask
+        while True:
+            slot = table[idx]
+            if slot == digest:
+                return True
+            if slot == 0:
+                break
+            idx = (idx + 1) & mask
+        table[idx] = digest
+        self.count += 1
+        if self.count * 2 > len(table):
+            self._grow()
+        return False
+
+    def _grow(self):
+        old_table = self.table
+        self.table = array('Q', bytes(16 * len(old_table)))
+        self.mask = len(self.table) - 1
+        table = self.table
+        mask = self.mask
+        for digest in old_table:
+            if digest:
+                idx = digest & mask
+                while table[idx]:
+                    idx = (idx + 1) & mask
+                table[idx] = digest
+
+
+class IdSummary(object):
+    # write the OLD<TAB>NEW summary incrementally (one line per old ID, in order of first
+    # appearance); IDs are only remembered as 64-bit digests (DigestSet), enough to skip repeated
+    # IDs and to detect two old IDs modified to the same new ID
+    def __init__(self, summary_f):
+        self.summary_f = summary_f
+        self.old_ids = DigestSet()
+        self.new_ids = DigestSet()
+        self.collisions = 0
+
+    def add(self, old_id, new_id):
+        # old_id, new_id: bytes
+        if self.old_ids.add(old_id):
+            return
+        if self.summary_f is not None:
+            self.summary_f.write(old_id + b'\t' + new_id + b'\n')
+        if self.new_ids.add(new_id):
+            self.collisions += 1
+            logger.warning('ID collision: %s is modified to %s, which is already used by another ID' % (old_id.decode('utf-8'), new_id.decode('utf-8')))
+
+
+class HeaderRewriter(object):
+    # rewrite the header lines of rewrite_fasta()
+    def __init__(self, rewrite_id, out_f, summary_f):
+        self.rewrite_id = rewrite_id
+        self.out_f = out_f
+        self.summary = IdSummary(summary_f)
+
+    def header(self, line):
+        # line = stripped header line, '>' included
+        old_id = line.split(b' ')[0][1:]
+        new_id = self.rewrite_id(old_id)
+        self.out_f.write(b'>' + new_id + b'\n')
+        self.summary.add(old_id, new_id)
+
+    def lines(self, segment):
+        # slow path: strip every line (segment ends with a newline)
+        for line in segment.split(b'\n')[:-1]:
+            line = line.strip()
+            if line[0:1] == b'>':
+                self.header(line)
+            else:
+                self.out_f.write(line + b'\n')
+
+
+def rewrite_fasta(in_f, out_f, summary_f, rewrite_id, block_size=1 << 22):
+    # Rewrite the IDs of a FASTA file (binary streams). Sequence lines are passed through in
+    # large byte blocks without decoding; only header lines, and blocks with whitespace to
+    # strip, are handled line by line. Return the number of ID collisions.
+    rewriter = HeaderRewriter(rewrite_id, out_f, summary_f)
+    carry = b''
+    while True:
+        chunk = in_f.read(block_size)
+        data = carry + chunk
+        if not data:
+            break
+        if chunk:
+            # only process complete lines, keep the rest for the next block
+            end = data.rfind(b'\n') + 1
+            if end == 0:
+                carry = data
+                continue
+        else:
+            if not data.endswith(b'\n'):
+                data += b'\n'
+            end = len(data)
+        carry = data[end:]
+        i = 0
+        while i < end:
+            if data[i:i + 1] == b'>':
+                eol = data.find(b'\n', i, end)
+                rewriter.header(data[i:eol].strip())
+                i = eol + 1
+            else:
+                next_header = data.find(b'\n>', i, end)
+                if next_header == -1:
+                    stop = end
+                else:
+                    stop = next_header + 1
+                segment = data[i:stop]
+                if DIRTY_SEGMENT.search(segment):
+                    rewriter.lines(segment)
+                else:
+                    out_f.write(segment)
+                i = stop
+        if not chunk:
+            break
+    return rewriter.summary.collisions
+
+
+def run_pipeline(input_file, out_f, min_length=None, clean_ids=False, rewrite_id=None, report_out=None, summary_out=None, size_out=None, threads=1, content=None):
+    # Apply the stages to every record of input_file in one pass and write the records that
+    # remain to out_f (text stream). The result is the same as running the stages one after
+    # another as separate scripts:
+    #   min_length  remove the sequences shorter than min_length (FilterFastaByLength.py)
+    #   content     seq_stats.ContentFilter, remove the sequences failing the content filters and
+    #               add the content statistics to the report lines
+    #   clean_ids   ID = first word with the reserved characters replaced by '_'
+    #   rewrite_id  ID = first word translated by compile_rules() (modification_fasta_ID.py)
+    # The reports are optional text streams:
+    #   report_out  Old_Fasta_ID<TAB>New_Fasta_ID<TAB>Length<TAB>Status of every record
+    #   summary_out (binary) ID before<TAB>after the translation, as modification_fasta_ID.py
+    #   size_out    New_Fasta_ID<TAB>Length of the written records (chrom sizes), written at the end
+    # return {'records': ..., 'remain': ..., 'remove': ..., 'collisions': ...}
+    # the first word of every header, as a 64-bit digest
+    seen_ids = DigestSet()
+    # sequence_length = {'SequenceID': Sequence_length}
+    sequence_length = dict()
+    id_summary = IdSummary(summary_out) if rewrite_id is not None else None
+    stats = {
+        'records': 0,
+        'remain': 0,
+        'remove': 0,
+        'collisions': 0
+    }
+    records = fasta_iter(input_file, threads)
+    if content is None:
+        records = ((fasta_id, sequence_list, list(), True) for fasta_id, sequence_list in records)
+    else:
+        # the content statistics are computed in batches of records
+        records = content.annotate(records)
+    for fasta_id, sequence_list, content_values, passed in records:
+        stats['records'] += 1
+        words = fasta_id.split(None, 1)
+        if seen_ids.add(words[0].encode('utf-8') if words else b''):
+            logger.warning('Duplicate ID found! %s' % (fasta_id))
+        seq_length = sum(len(line) for line in sequence_list)
+        if (min_length is not None and seq_length < min_length) or not passed:
+            stats['remove'] += 1
+            if report_out is not None:
+                report_out.write('\t'.join([fasta_id, 'NA', str(seq_length), 'remove'] + content_values) + '\n')
+            continue
+        stats['remain'] += 1
+        new_fasta_id = fasta_id
+        if clean_ids:
+            new_fasta_id = replace_reserved_char(new_fasta_id)
+        if rewrite_id is not None:
+            old_id = new_fasta_id.split(' ')[0].encode('utf-8')
+            new_id = rewrite_id(old_id)
+            id_summary.add(old_id, new_id)
+            new_fasta_id = new_id.decode('utf-8')
+        if report_out is not None:
+            report_out.write('\t'.join([fasta_id, new_fasta_id, str(seq_length), 'remain'] + content_values) + '\n')
+        if size_out is not None:
+            words = new_fasta_id.split()
+            sequence_length[words[0] if words else ''] = seq_length
+        out_f.write('>' + new_fasta_id + '\n')
+        for line in sequence_list:
+            out_f.write(line + '\n')
+    if size_out is not None:
+        # the same as the chrom size file of fasta_index.py, one line per ID
+        for sequence_id in sequence_length:
+            size_out.write('%s\t%d\n' % (sequence_id, sequence_length[sequence_id]))
+    if id_summary is not None:
+        stats['collisions'] = id_summary.collisions
+    return stats
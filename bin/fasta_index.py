@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# Read, build and write samtools-compatible FASTA indexes (.fai).
+#
+# Each line of a .fai file is: NAME LENGTH OFFSET LINEBASES LINEWIDTH
+# so the sequence lengths (chrom sizes) can be loaded without touching the FASTA.
+
+import os
+import sys
+import hashlib
+import logging
+import compressed_io
+import instrument
+
+__version__ = '1.0.0'
+
+# logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    lh = logging.StreamHandler()
+    lh.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
+    logger.addHandler(lh)
+
+FAI_FIELDS = ['length', 'offset', 'linebases', 'linewidth']
+
+
+def fai_file_name(fasta_file):
+    return fasta_file + '.fai'
+
+
+def index_is_current(fasta_file, fai_file=None):
+    # the index is up to date if it is not older than the FASTA file
+    if fai_file is None:
+        fai_file = fai_file_name(fasta_file)
+    if not os.path.exists(fai_file):
+        return False
+    return os.path.getmtime(fai_file) >= os.path.getmtime(fasta_file)
+
+
+def read_fai(fai_file):
+    # fai_dict = {'SequenceID': {'length': ..., 'offset': ..., 'linebases': ..., 'linewidth': ...}}
+    fai_dict = dict()
+    with open(fai_file, 'r') as in_f:
+        for line in in_f:
+            line = line.rstrip('\n')
+            if line:
+                tokens = line.split('\t')
+                if len(tokens) < 5:
+                    logger.error('%s: Not a valid FASTA index line: %s' % (fai_file, line))
+                    sys.exit(1)
+                fai_dict[tokens[0]] = dict(zip(FAI_FIELDS, [int(value) for value in tokens[1:5]]))
+    return fai_dict
+
+
+def write_fai(fai_dict, fai_file):
+    # write to a temporary file first, so a concurrent reader never sees a partial index
+    tmp_file = '%s.tmp%d' % (fai_file, os.getpid())
+    with open(tmp_file, 'w') as out_f:
+        for sequence_id in fai_dict:
+            outline = [sequence_id]
+            outline.extend([str(fai_dict[sequence_id][field]) for field in FAI_FIELDS])
+            out_f.write('\t'.join(outline) + '\n')
+    os.replace(tmp_file, fai_file)
+
+
+def build_fai(fasta_file, block_size=1 << 24, threads=1):
+    # Scan the FASTA file once in large blocks. Only header lines and the first sequence line
+    # of every record are looked at individually, the rest is counted with bytes.count().
+    # compressed input is indexed in uncompressed coordinates
+    in_f = compressed_io.open_input(fasta_file, threads)
+    fai_dict = dict()
+    record = None
+    # file offset of data[0]
+    file_pos = 0
+    carry = b''
+    with in_f:
+        while True:
+            chunk = in_f.read(block_size)
+            data = carry + chunk
+            if not data:
+                break
+            if chunk:
+                # only process complete lines, keep the rest for the next block
+                end = data.rfind(b'\n') + 1
+                if end == 0:
+                    carry = data
+                    continue
+            else:
+                end = len(data)
+            carry = data[end:]
+            i = 0
+            while i < end:
+                if data[i:i + 1] == b'>':
+                    eol = data.find(b'\n', i, end)
+                    if eol == -1:
+                        eol = end
+                    header = data[i + 1:eol].strip().split()
+                    sequence_id = header[0].decode('utf-8') if header else ''
+                    if sequence_id in fai_dict:
+                        logger.warning('Duplicate ID found! %s' % (sequence_id))
+                    record = {
+                        'length': 0,
+                        'offset': file_pos + eol + 1,
+                        'linebases': 0,
+                        'linewidth': 0
+                    }
+                    fai_dict[sequence_id] = record
+                    i = eol + 1
+                else:
+                    next_header = data.find(b'\n>', i, end)
+                    if next_header == -1:
+                        stop = end
+                    else:
+                        stop = next_header + 1
+                    if record is None:
+                        if data[i:stop].strip():
+                            logger.error('%s: Sequence found before the first FASTA header' % (fasta_file))
+                            sys.exit(1)
+                        i = stop
+                        continue
+                    if record['linewidth'] == 0:
+                        # line width of the first non-empty sequence line
+                        line_start = i
+                        while line_start < stop:
+                            eol = data.find(b'\n', line_start, stop)
+                            if eol == -1:
+                                eol = stop - 1
+                            line = data[line_start:eol + 1]
+                            if line.strip():
+                                record['linewidth'] = len(line)
+                                record['linebases'] = len(line.rstrip(b'\r\n'))
+                                break
+                            line_start = eol + 1
+                    record['length'] += (stop - i) - data.count(b'\n', i, stop) - data.count(b'\r', i, stop)
+                    i = stop
+            file_pos += end
+            if not chunk:
+                break
+    return fai_dict
+
+
+def load_fai(fasta_file, save=True, threads=1):
+    # use the .fai next to the FASTA file when it is up to date, otherwise build it and save it
+    fai_file = fai_file_name(fasta_file)
+    if index_is_current(fasta_file, fai_file):
+        return read_fai(fai_file)
+    fai_dict = build_fai(fasta_file, threads=threads)
+    if save:
+        if compressed_io.is_gzip(fasta_file):
+            # offsets of a gzip file can not be used for random access by samtools
+            logger.info('%s: Compressed FASTA, the index is not saved' % (fasta_file))
+        else:
+            try:
+                write_fai(fai_dict, fai_file)
+            except (IOError, OSError) as e:
+                logger.warning('%s: Failed to save the FASTA index (%s)' % (fai_file, e))
+    return fai_dict
+
+
+def sequence_lengths(fasta_file, save=True, threads=1):
+    # sequence_length = {'SequenceID': Sequence_length}
+    fai_dict = load_fai(fasta_file, save=save, threads=threads)
+    return dict((sequence_id, fai_dict[sequence_id]['length']) for sequence_id in fai_dict)
+
+
+def default_cache_dir():
+    # $XDG_CACHE_HOME/genomic_data_processing/chrom_sizes, ~/.cache/... by default
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'genomic_data_processing', 'chrom_sizes')
+
+
+def cache_key(fasta_file):
+    # the cached sizes are valid while the path, size and mtime of the FASTA file are unchanged
+    stat = os.stat(fasta_file)
+    return '%s\t%d\t%d' % (os.path.abspath(fasta_file), stat.st_size, stat.st_mtime_ns)
+
+
+def cache_file_name(fasta_file, cache_dir):
+    # one cache file per FASTA path, a stale entry is overwritten
+    return os.path.join(cache_dir, hashlib.sha1(os.path.abspath(fasta_file).encode('utf-8')).hexdigest() + '.size')
+
+
+def read_cached_lengths(cache_file, key):
+    # return the cached sequence_length, or None when the cache file is missing, stale or broken
+    # first line: '#' + key, then SequenceID<TAB>Length lines
+    sequence_length = dict()
+    try:
+        with open(cache_file, 'r') as in_f:
+            if in_f.readline().rstrip('\n') != '#' + key:
+                return None
+            for line in in_f:
+                sequence_id, length = line.rstrip('\n').rsplit('\t', 1)
+                sequence_length[sequence_id] = int(length)
+    except (IOError, OSError, ValueError):
+        return None
+    return sequence_length
+
+
+def write_cached_lengths(cache_file, key, sequence_length):
+    # write to a temporary file first, so a concurrent reader never sees a partial cache file
+    tmp_file = '%s.tmp%d' % (cache_file, os.getpid())
+    try:
+        with open(tmp_file, 'w') as out_f:
+            out_f.write('#' + key + '\n')
+            for sequence_id in sequence_length:
+                out_f.write('%s\t%d\n' % (sequence_id, sequence_length[sequence_id]))
+        os.replace(tmp_file, cache_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def cached_sequence_lengths(fasta_file, cache_dir=None, threads=1):
+    # sequence_lengths() through a persistent cache in cache_dir (default_cache_dir() by default),
+    # so repeated runs against the same genome neither scan the FASTA nor read its index
+    # return (sequence_length, True if it came from the cache)
+    if not os.path.exists(fasta_file):
+        logger.error('%s: No Such file or directory' % (fasta_file))
+        sys.exit(1)
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    key = cache_key(fasta_file)
+    cache_file = cache_file_name(fasta_file, cache_dir)
+    sequence_length = read_cached_lengths(cache_file, key)
+    if sequence_length is not None:
+        return sequence_length, True
+    sequence_length = sequence_lengths(fasta_file, threads=threads)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        write_cached_lengths(cache_file, key, sequence_length)
+    except (IOError, OSError) as e:
+        logger.warning('%s: Failed to cache the chrom sizes (%s)' % (cache_dir, e))
+    return sequence_length, False
+
+
+def main():
+    import argparse
+    from textwrap import dedent
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=dedent("""\
+    Build a samtools-compatible FASTA index (.fai), or print the sequence lengths (chrom sizes).
+
+    Quick start:
+    %(prog)s -f genome.fasta
+    %(prog)s -f genome.fasta -c chrom.size
+    """))
+    # argument
+    parser.add_argument('-f', '--fasta', type=str, help='The genome fasta', required=True)
+    parser.add_argument('-c', '--chrom_size', type=str, help='Write a chrom.size file (SequenceID<TAB>Length)')
+    parser.add_argument('-t', '--threads', type=int, help='Threads for BGZF decompression, default: 1', default=1)
+    instrument.add_arguments(parser)
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
+
+    args = parser.parse_args()
+    instrument.start('fasta_index', __version__, args)
+    with instrument.stage('index', input_file=args.fasta) as stage:
+        sequence_length = sequence_lengths(args.fasta, threads=args.threads)
+        stage.add(records=len(sequence_length))
+    if args.chrom_size:
+        with instrument.stage('chrom_size'):
+            with open(args.chrom_size, 'w') as chrom_f:
+                for scaffold in sequence_length:
+                    chrom_f.write(scaffold + '\t' + str(sequence_length[scaffold]) + '\n')
+
+
+if __name__ == '__main__':
+    main()
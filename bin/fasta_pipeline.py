@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# Filter, clean and rename the sequences of a FASTA file in one streaming pass.
+#
+# Runs the stages of FilterFastaByLength.py, modification_fasta_ID.py and the chrom size report
+# of fasta_index.py over the records once, instead of parsing and writing the whole file once
+# per script. The output is the same as running the scripts one after another.
+
+import re
+import sys
+import logging
+import compressed_io
+import fasta_core
+import instrument
+
+__version__ = '1.0.0'
+
+# logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    lh = logging.StreamHandler()
+    lh.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
+    logger.addHandler(lh)
+
+
+def main():
+    import argparse
+    from textwrap import dedent
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter, description=dedent("""\
+    Filter, clean and rename the sequences of a FASTA file in one pass.
+    Stages (in this order, each one optional):
+      length filter       -l: remove the sequences shorter than [length]
+      ID cleaning         -clean: replace the Linux reserved characters of the IDs by '_'
+      ID translation      -translate / -m: digits to letters, or the rules of a mapping file
+      length report       -size: write the ID and the length of every written sequence
+
+    Quick start:
+    %(prog)s -i input.fasta -o output.fasta -l 50 -clean -r report.txt
+    %(prog)s -i input.fasta.gz -o output.fasta -l 50 -clean -translate -s summary.txt -size chrom.size
+    """))
+    # argument
+    parser.add_argument('-i', '--input_file', type=str, help='input FASTA file (plain, gzip or BGZF)', required=True)
+    parser.add_argument('-o', '--output_file', type=str, help='Specify the output filename', required=True)
+    parser.add_argument('-l', '--length', type=int, help='Remove the sequences that are shorter than [length]')
+    parser.add_argument('-clean', '--clean_ids', action='store_true', help='Keep the first word of the IDs and replace the reserved characters by \'_\'')
+    parser.add_argument('-translate', '--translate_ids', action='store_true', help='Translate the IDs, default rules: digits to letters\n(1->A 2->B 3->C 4->D 5->E 6->F 7->G 8->I 9->J 0->K)')
+    parser.add_argument('-m', '--mapping', type=str, help='Translate the IDs with a mapping file of OLD<TAB>NEW rules')
+    parser.add_argument('-regex', '--regex', action='store_true', help='The OLD column of the mapping file contains regular expressions')
+    parser.add_argument('-r', '--report', type=str, help='Write a table of the old IDs, new IDs, lengths and status (remain/remove)')
+    parser.add_argument('-s', '--summary', type=str, help='Write a table of the IDs before and after the translation')
+    parser.add_argument('-size', '--chrom_size', type=str, help='Write the ID and the length of every written sequence (chrom.size)')
+    parser.add_argument('-t', '--threads', type=int, help='Threads for BGZF decompression/compression, default: 1', default=1)
+    parser.add_argument('-c', '--compress', action='store_true', help='Write BGZF compressed output')
+    instrument.add_arguments(parser)
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
+
+    args = parser.parse_args()
+    instrument.start('fasta_pipeline', __version__, args)
+
+    rewrite_id = None
+    if args.translate_ids or args.mapping:
+        if args.mapping:
+            mapping = fasta_core.load_mapping(args.mapping)
+        else:
+            mapping = fasta_core.transfor_dict
+        try:
+            rewrite_id = fasta_core.compile_rules(mapping, args.regex)
+        except re.error as e:
+            logger.error('Invalid regular expression in %s: %s' % (args.mapping, e))
+            sys.exit(1)
+    elif args.summary:
+        logger.error('--summary needs the ID translation (-translate or -m)')
+        sys.exit(1)
+
+    report_out = None
+    summary_out = None
+    size_out = None
+    try:
+        if args.report:
+            report_out = open(args.report, 'w')
+            report_out.write('#filename: %s\n' % (args.input_file))
+            report_out.write('\t'.join(['#Old_Fasta_ID', 'New_Fasta_ID', 'Length', 'Status']) + '\n')
+        if args.summary:
+            summary_out = open(args.summary, 'wb')
+        if args.chrom_size:
+            size_out = open(args.chrom_size, 'w')
+        with instrument.stage('pipeline', input_file=args.input_file) as stage:
+            with compressed_io.open_output(args.output_file, args.compress, args.threads) as out_f:
+                stats = fasta_core.run_pipeline(args.input_file, out_f, args.length, args.clean_ids, rewrite_id, report_out, summary_out, size_out, args.threads)
+            stage.add(records=stats['records'])
+    finally:
+        for report_f in [report_out, summary_out, size_out]:
+            if report_f is not None:
+                report_f.close()
+    logger.info('%d sequence(s): %d remain, %d removed' % (stats['records'], stats['remain'], stats['remove']))
+    if stats['collisions']:
+        logger.warning('%d ID(s) were modified to an ID already used by another sequence' % (stats['collisions']))
+
+
+if __name__ == '__main__':
+    main()
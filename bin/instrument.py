@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# Per-stage instrumentation shared by the scripts (--stats / --profile).
+#
+# A script calls start() once after parsing its arguments and wraps its steps in
+# "with stage('name') as s:". For every stage the wall time, CPU time, CPU time of the
+# subprocesses (and worker processes) it waited for, bytes read/written (Linux /proc/self/io),
+# records and the peak RSS are recorded, and the report is written as JSON when the script
+# exits. When neither --stats nor --profile is given, stage() returns a shared no-op object.
+
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import resource
+
+__version__ = '1.0.0'
+
+# logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    lh = logging.StreamHandler()
+    lh.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
+    logger.addHandler(lh)
+
+# hot functions listed in the JSON report with --profile
+PROFILE_TOP = 30
+
+# the active session, None when the instrumentation is off
+_session = None
+
+
+def add_arguments(parser):
+    parser.add_argument('--stats', type=str, help='Write per-stage timing, I/O, throughput and memory statistics to a JSON file')
+    parser.add_argument('--profile', type=str, help='Profile the run with cProfile and write the profile to a file (pstats format)')
+
+
+def io_counters():
+    # (bytes read, bytes written) by this process, None when /proc/self/io is not available
+    try:
+        with open('/proc/self/io', 'r') as io_f:
+            counters = dict(line.split(':', 1) for line in io_f)
+        return int(counters['rchar']), int(counters['wchar'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def snapshot():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'wall': time.perf_counter(),
+        'cpu': self_usage.ru_utime + self_usage.ru_stime,
+        'subprocess': children_usage.ru_utime + children_usage.ru_stime,
+        # kilobytes on Linux
+        'peak_rss_kb': self_usage.ru_maxrss,
+        'subprocess_peak_rss_kb': children_usage.ru_maxrss,
+        'io': io_counters()
+    }
+
+
+def difference(start, end):
+    result = {
+        'wall_time': end['wall'] - start['wall'],
+        'cpu_time': end['cpu'] - start['cpu'],
+        'subprocess_time': end['subprocess'] - start['subprocess'],
+        # high-water marks of the process (and its waited-for children) at the end of the stage
+        'peak_rss_kb': end['peak_rss_kb'],
+        'subprocess_peak_rss_kb': end['subprocess_peak_rss_kb']
+    }
+    if start['io'] is not None and end['io'] is not None:
+        result['bytes_read'] = end['io'][0] - start['io'][0]
+        result['bytes_written'] = end['io'][1] - start['io'][1]
+    return result
+
+
+class NullStage(object):
+    # returned by stage() when the instrumentation is off
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def add(self, records=0):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+class Stage(object):
+    def __init__(self, session, name, info):
+        self.session = session
+        self.name = name
+        self.info = info
+        self.records = 0
+        self.start = None
+
+    def __enter__(self):
+        self.start = snapshot()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record = {'name': self.name}
+        record.update(self.info)
+        record.update(difference(self.start, snapshot()))
+        if self.records:
+            record['records'] = self.records
+            if record['wall_time'] > 0:
+                record['records_s'] = self.records / record['wall_time']
+        if exc_type is not None:
+            record['failed'] = True
+        self.session.stages.append(record)
+        return False
+
+    def add(self, records=0):
+        self.records += records
+
+
+class Session(object):
+    def __init__(self, script, version, stats_file, profile_file):
+        self.script = script
+        self.version = version
+        self.stats_file = stats_file
+        self.profile_file = profile_file
+        self.stages = list()
+        self.profiler = None
+        self.start = snapshot()
+        if profile_file:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def hot_functions(self):
+        import pstats
+        profile_stats = pstats.Stats(self.profiler).stats
+        functions = list()
+        for (file_name, line_number, function_name), (cc, nc, tt, ct, callers) in profile_stats.items():
+            functions.append({
+                'function': '%s:%d(%s)' % (file_name, line_number, function_name),
+                'calls': nc,
+                'tottime': tt,
+                'cumtime': ct
+            })
+        functions.sort(key=lambda function: function['tottime'], reverse=True)
+        return functions[:PROFILE_TOP]
+
+    def finish(self):
+        report = {
+            'script': self.script,
+            'version': self.version,
+            'argv': sys.argv,
+            'pid': os.getpid(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+        report.update(difference(self.start, snapshot()))
+        report['stages'] = self.stages
+        if self.profiler is not None:
+            self.profiler.disable()
+            try:
+                self.profiler.dump_stats(self.profile_file)
+            except (IOError, OSError) as e:
+                logger.warning('%s: Failed to write the profile (%s)' % (self.profile_file, e))
+            report['profile'] = self.hot_functions()
+        if self.stats_file:
+            try:
+                with open(self.stats_file, 'w') as out_f:
+                    json.dump(report, out_f, indent=2)
+                    out_f.write('\n')
+            except (IOError, OSError) as e:
+                logger.warning('%s: Failed to write the statistics (%s)' % (self.stats_file, e))
+
+
+def start(script, version, args):
+    # start the instrumentation if --stats or --profile was given, the report is written at exit
+    global _session
+    stats_file = getattr(args, 'stats', None)
+    profile_file = getattr(args, 'profile', None)
+    if not stats_file and not profile_file:
+        return
+    _session = Session(script, version, stats_file, profile_file)
+    atexit.register(_session.finish)
+
+
+def stage(name, **info):
+    # with stage('parse', input_file=input_file) as s: ...; s.add(records=n)
+    if _session is None:
+        return NULL_STAGE
+    return Stage(_session, name, info)
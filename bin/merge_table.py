@@ -1,12 +1,35 @@
 #!/usr/bin/env python
 # Contributed by Li-Mei Chiang <dytk2134 [at] gmail [dot] com> (2020)
 
+"""
+
+Changelog:
+    1.3.0: Per-stage statistics (--stats) and cProfile output (--profile); add samples to an earlier output
+           (--append_to) with an optional sidecar index (--write_index)
+    1.2.0: Out-of-core mode (--sorted): the input files are sorted on disk in runs of --buffer_lines lines
+           (in --tmp_dir) and joined with a streaming merge, the rows are sorted by index; --jobs is not
+           used in this mode. The outputs are written to temporary files and put in place at the end
+    1.1.0: Column-wise matrix (numbers in int64/float64 arrays when they are written back unchanged) instead of
+           one list of strings per index; several --target columns merged in one run (one output per column,
+           or one with --wide); input files parsed in parallel worker processes (--jobs), the output is the
+           same as in a serial run
+
+"""
+
 import os
 import sys
+import json
+import heapq
+import shutil
+import tempfile
+import multiprocessing
 import subprocess
 import logging
+from array import array
+from operator import itemgetter
+import instrument
 
-__version__ = '1.0.0'
+__version__ = '1.3.0'
 
 # logger
 logger = logging.getLogger(__name__)
@@ -23,46 +46,458 @@ def generate_sample_ids(input_files):
         sample_ids.append(filename)
     return sample_ids
 
-def merge_files(input_files, skip, index, target, default):
-    merge_dict = dict()
-
-    for idx, input_file in enumerate(input_files):
-        with open(input_file, 'r') as in_f:
-            for line_idx, line in enumerate(in_f):
-                if line_idx < skip:
-                    continue
-                else:
-                    line = line.strip()
-                    if line:
-                        tokens = line.split('\t')
+def parse_file(input_file, skip, index, targets):
+    # yield (index value, [target values]) of every line of input_file
+    with open(input_file, 'r') as in_f:
+        for line_idx, line in enumerate(in_f):
+            if line_idx < skip:
+                continue
+            else:
+                line = line.strip()
+                if line:
+                    tokens = line.split('\t')
+                    try:
+                        key = tokens[index]
+                    except IndexError:
+                        logger.error('Index Column: %d, out of range.' % (index))
+                        sys.exit(1)
+                    values = list()
+                    for target in targets:
                         try:
-                            if tokens[index] not in merge_dict:
-                                merge_dict[tokens[index]] = [default] * len(input_files)
-                            else:
-                                if merge_dict[tokens[index]][idx] != default and merge_dict[tokens[index]][idx] != tokens[target]:
-                                    logger.warning('Index (Column %d) is not unique. Duplicate values find: %s.' % (index, tokens[index]))
-                        except IndexError:
-                            logger.error('Index Column: %d, out of range.' % (index))
-                            sys.exit(1)
-                        try:
-                            merge_dict[tokens[index]][idx] = tokens[target]
+                            values.append(tokens[target])
                         except IndexError:
                             logger.error('Target Column: %d, out of range.' % (target))
                             sys.exit(1)
+                    yield key, values
+
+def is_duplicate(old_values, values, default):
+    # the index is not unique if a value was already set in this file and it is different
+    for old_value, value in zip(old_values, values):
+        if old_value != default and old_value != value:
+            return True
+    return False
+
+def int64(value):
+    number = int(value)
+    if not -2 ** 63 <= number < 2 ** 63:
+        raise OverflowError(value)
+    return number
+
+class Column(object):
+    # Values of one target column of one sample, stored by row number.
+    # Numbers are kept in a typed array when every value is written back unchanged by str()/repr(),
+    # otherwise the values are kept as (shared) strings. Rows without a value return the default.
+    __slots__ = ('values', 'mask', 'numeric')
+
+    def __init__(self, row_values, size):
+        # row_values = {row: value}
+        self.numeric = None
+        for typecode, convert, output in (('q', int64, str), ('d', float, repr)):
+            try:
+                if all(output(convert(value)) == value for value in row_values.values()):
+                    self.numeric = typecode
+                    break
+            except (ValueError, OverflowError):
+                continue
+        if self.numeric:
+            convert = int if self.numeric == 'q' else float
+            self.values = array(self.numeric, bytes(array(self.numeric).itemsize * size))
+            self.mask = bytearray(size)
+            for row, value in row_values.items():
+                self.values[row] = convert(value)
+                self.mask[row] = 1
+        else:
+            pool = dict()
+            self.values = [None] * size
+            self.mask = None
+            for row, value in row_values.items():
+                self.values[row] = pool.setdefault(value, value)
+
+    def get(self, row, default):
+        if row >= len(self.values):
+            return default
+        if self.numeric:
+            if not self.mask[row]:
+                return default
+            return str(self.values[row]) if self.numeric == 'q' else repr(self.values[row])
+        value = self.values[row]
+        return default if value is None else value
+
+def read_file(input_file, skip, index, targets, default):
+    # parse one input file into a compact key -> values mapping:
+    # (keys in order of first appearance, [[values of every key]] of every target, duplicated keys)
+    file_rows = dict()
+    file_values = list()
+    duplicates = list()
+    for key, values in parse_file(input_file, skip, index, targets):
+        row = file_rows.get(key)
+        if row is None:
+            file_rows[key] = len(file_values)
+            file_values.append(values)
+        else:
+            if is_duplicate(file_values[row], values, default):
+                duplicates.append(key)
+            file_values[row] = values
+    keys = list(file_rows)
+    target_values = [[values[target_idx] for values in file_values] for target_idx in range(len(targets))]
+    return keys, target_values, duplicates
+
+def read_file_job(job):
+    # run read_file() in a worker process; errors are logged by the worker, None tells the parent to stop
+    try:
+        return read_file(*job)
+    except SystemExit:
+        return None
+
+def merge_files(input_files, skip, index, targets, default, jobs=1, keys=None):
+    # Compact in-memory matrix: keys are numbered in order of first appearance and every
+    # (target, sample) pair is stored as one Column, instead of one list of strings per key.
+    # merge_matrix = {'keys': [key], 'columns': [[Column of sample]] of every target}
+    # With jobs > 1 the files are parsed in a process pool, the matrix is always assembled
+    # in input file order, so the result and the warnings are the same as in a serial run.
+    # keys = the rows of an existing matrix (--append_to), new keys are numbered after them
+    keys = list() if keys is None else list(keys)
+    key_rows = dict((key, row) for row, key in enumerate(keys))
+    columns = [list() for target in targets]
+
+    file_jobs = [(input_file, skip, index, targets, default) for input_file in input_files]
+    if jobs > 1:
+        pool = multiprocessing.Pool(min(jobs, len(file_jobs)))
+        results = pool.imap(read_file_job, file_jobs)
+    else:
+        pool = None
+        results = (read_file(*job) for job in file_jobs)
+    try:
+        for result in results:
+            if result is None:
+                sys.exit(1)
+            file_keys, target_values, duplicates = result
+            for key in duplicates:
+                logger.warning('Index (Column %d) is not unique. Duplicate values find: %s.' % (index, key))
+            file_row_list = list()
+            for key in file_keys:
+                row = key_rows.get(key)
+                if row is None:
+                    row = len(keys)
+                    key_rows[key] = row
+                    keys.append(key)
+                file_row_list.append(row)
+            for target_idx in range(len(targets)):
+                columns[target_idx].append(Column(dict(zip(file_row_list, target_values[target_idx])), len(keys)))
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    return {'keys': keys, 'columns': columns}
+
+def matrix_rows(merge_matrix, default):
+    # yield (index, [[values of every sample]] of every target)
+    for row, key in enumerate(merge_matrix['keys']):
+        yield key, [[column.get(row, default) for column in target_columns] for target_columns in merge_matrix['columns']]
+
+def new_run_file(tmp_dir):
+    fd, run_file = tempfile.mkstemp(suffix='.tsv', dir=tmp_dir)
+    os.close(fd)
+    return run_file
+
+def write_run(run, run_file):
+    with open(run_file, 'w') as run_f:
+        for key, values in run:
+            run_f.write(key + '\t' + '\t'.join(values) + '\n')
+
+def read_run(run_file):
+    with open(run_file, 'r') as run_f:
+        for line in run_f:
+            tokens = line.rstrip('\n').split('\t')
+            yield tokens[0], tokens[1:]
+
+def sort_file(input_file, skip, index, targets, tmp_dir, buffer_lines, budget):
+    # sort the (index value, target values) pairs of input_file by index value, the sort is stable,
+    # so duplicate index values keep their order in the file.
+    # Pairs are sorted in runs of buffer_lines, runs are spilled to tmp_dir when needed.
+    # budget = [number of pairs that may still be kept in memory], shared by all input files
+    run_files = list()
+    run = list()
+    for pair in parse_file(input_file, skip, index, targets):
+        run.append(pair)
+        if len(run) >= buffer_lines:
+            run.sort(key=itemgetter(0))
+            run_file = new_run_file(tmp_dir)
+            write_run(run, run_file)
+            run_files.append(run_file)
+            run = list()
+    run.sort(key=itemgetter(0))
+    if not run_files and len(run) <= budget[0]:
+        # small file, keep it in memory
+        budget[0] -= len(run)
+        return run
+    if run:
+        run_file = new_run_file(tmp_dir)
+        write_run(run, run_file)
+        run_files.append(run_file)
+    if len(run_files) == 1:
+        return run_files[0]
+    # merge the runs into one sorted file, so every input file needs only one open file in the join
+    sorted_file = new_run_file(tmp_dir)
+    write_run(heapq.merge(*[read_run(run_file) for run_file in run_files], key=itemgetter(0)), sorted_file)
+    for run_file in run_files:
+        os.remove(run_file)
+    return sorted_file
+
+def tag_pairs(pairs, idx):
+    for key, values in pairs:
+        yield key, idx, values
+
+def merge_files_sorted(input_files, skip, index, targets, default, tmp_dir=None, buffer_lines=1000000):
+    # Out-of-core sort-merge join: sort every input file by its index column, then join all
+    # the files with a streaming k-way merge.
+    # Yield (index, [[values of every sample]] of every target) in sorted index order.
+    temp_dir = tempfile.mkdtemp(prefix='merge_table.', dir=tmp_dir)
+    try:
+        budget = [buffer_lines]
+        streams = list()
+        for idx, input_file in enumerate(input_files):
+            with instrument.stage('sort', input_file=input_file):
+                run = sort_file(input_file, skip, index, targets, temp_dir, buffer_lines, budget)
+            if isinstance(run, list):
+                pairs = run
+            else:
+                pairs = read_run(run)
+            streams.append(tag_pairs(pairs, idx))
+        # heapq.merge is stable, ties are taken in input file order
+        row_key = None
+        row = None
+        for key, idx, values in heapq.merge(*streams, key=itemgetter(0)):
+            if key != row_key:
+                if row is not None:
+                    yield row_key, row
+                row_key = key
+                row = [[default] * len(input_files) for target in targets]
+            elif is_duplicate([target_values[idx] for target_values in row], values, default):
+                logger.warning('Index (Column %d) is not unique. Duplicate values find: %s.' % (index, key))
+            for target_idx, value in enumerate(values):
+                row[target_idx][idx] = value
+        if row is not None:
+            yield row_key, row
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
 
-    return merge_dict
+def output_files(output_file, targets, wide):
+    # one output file per target, unless there is only one target or a wide output is requested
+    if len(targets) == 1 or wide:
+        return [output_file]
+    filename, fileext = os.path.splitext(output_file)
+    return ['%s_%d%s' % (filename, target, fileext) for target in targets]
 
-def output_result(merge_dict, sample_ids, output_file):
-    with open(output_file, 'w') as out_f:
+def write_rows(rows, sample_ids, targets, output_file, wide=False):
+    # rows = iterable of (index, [[values of every sample]] of every target), written as they come;
+    # the outputs are only put in place when all the rows were written, so an input error while
+    # the rows are joined (--sorted) does not leave a truncated output
+    filenames = output_files(output_file, targets, wide)
+    tmp_files = ['%s.tmp%d' % (filename, os.getpid()) for filename in filenames]
+    out_fs = list()
+    try:
+        for tmp_file in tmp_files:
+            out_fs.append(open(tmp_file, 'w'))
         # header
+        if len(out_fs) == 1 and len(targets) > 1:
+            outline = ['#Index']
+            for target in targets:
+                outline.extend(['%s_%d' % (sample_id, target) for sample_id in sample_ids])
+            out_fs[0].write('\t'.join(outline) + '\n')
+        else:
+            for out_f in out_fs:
+                outline = ['#Index']
+                outline.extend(sample_ids)
+                out_f.write('\t'.join(outline) + '\n')
+        # merge result
+        for index, values in rows:
+            if len(out_fs) == 1:
+                outline = [index]
+                for target_values in values:
+                    outline.extend(target_values)
+                out_fs[0].write('\t'.join(outline) + '\n')
+            else:
+                for out_f, target_values in zip(out_fs, values):
+                    outline = [index]
+                    outline.extend(target_values)
+                    out_f.write('\t'.join(outline) + '\n')
+        for out_f in out_fs:
+            out_f.close()
+    except BaseException:
+        for out_f in out_fs:
+            out_f.close()
+        for tmp_file in tmp_files:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        raise
+    for tmp_file, filename in zip(tmp_files, filenames):
+        os.replace(tmp_file, filename)
+
+def output_result(merge_matrix, sample_ids, targets, output_file, default, wide=False):
+    write_rows(matrix_rows(merge_matrix, default), sample_ids, targets, output_file, wide)
+
+def index_file_name(output_file):
+    return output_file + '.idx'
+
+def file_state(filename):
+    stat = os.stat(filename)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def scan_merged(merged_files, targets, wide):
+    # build the sidecar index of merged output files by reading them once
+    # return {'samples': [...], 'keys': [...], 'files': [...]}
+    index = {'samples': None, 'keys': list(), 'files': list()}
+    for file_idx, merged_file in enumerate(merged_files):
+        with open(merged_file, 'rb') as in_f:
+            header = in_f.readline().rstrip(b'\n').decode('utf-8').split('\t')
+            if file_idx == 0:
+                if len(targets) > 1 and wide:
+                    # [sample id]_[target] for every target, then for every sample
+                    sample_count = (len(header) - 1) // len(targets)
+                    suffix = '_%d' % (targets[0])
+                    index['samples'] = [column[:-len(suffix)] if column.endswith(suffix) else column for column in header[1:1 + sample_count]]
+                else:
+                    index['samples'] = header[1:]
+            rows = 0
+            for row, line in enumerate(in_f):
+                key = line.split(b'\t', 1)[0].rstrip(b'\n').decode('utf-8')
+                if file_idx == 0:
+                    index['keys'].append(key)
+                elif row >= len(index['keys']) or index['keys'][row] != key:
+                    logger.error('%s: The rows are not the same as in %s' % (merged_file, merged_files[0]))
+                    sys.exit(1)
+                rows += 1
+        if file_idx > 0 and rows != len(index['keys']):
+            logger.error('%s: The rows are not the same as in %s' % (merged_file, merged_files[0]))
+            sys.exit(1)
+        index['files'].append(dict(name=os.path.basename(merged_file), **file_state(merged_file)))
+    return index
+
+def load_merged_index(merged_files, index_file, targets, wide, default):
+    # the sidecar index of the merged files (--write_index), built from the files when it is
+    # missing or the files were changed after it was written
+    try:
+        with open(index_file, 'r') as in_f:
+            index = json.load(in_f)
+        current = [dict(name=os.path.basename(merged_file), **file_state(merged_file)) for merged_file in merged_files]
+        if index['files'] == current:
+            if index.get('sorted'):
+                logger.error('%s: The matrix was written with --sorted, new rows can not be added in index order' % (index_file))
+                sys.exit(1)
+            if index['targets'] != targets or index['wide'] != wide:
+                logger.error('%s: The matrix was written with other --target/--wide options' % (index_file))
+                sys.exit(1)
+            if index['default'] != default:
+                logger.error('%s: The matrix was written with --default %s, not %s' % (index_file, index['default'], default))
+                sys.exit(1)
+            return index
+        logger.info('%s: The merged file(s) changed, rebuild the index' % (index_file))
+    except (IOError, OSError, ValueError, KeyError):
+        logger.info('%s: No valid index, build it from the merged file(s)' % (index_file))
+    index = scan_merged(merged_files, targets, wide)
+    keys = index['keys']
+    if len(keys) > 1 and all(keys[row] < keys[row + 1] for row in range(len(keys) - 1)):
+        logger.warning('%s: The rows are sorted by index; if the matrix was written with --sorted, the new rows are added at the end, not in order' % (merged_files[0]))
+    return index
+
+def append_rows(in_f, out_f, old_samples, new_samples, merge_matrix, targets, target_indexes, default, old_keys, wide):
+    # copy the rows of one merged file with the values of the new samples added, then write the
+    # rows of the new keys (default for the old samples); target_indexes = the targets in this file
+    columns = merge_matrix['columns']
+    split_targets = wide and len(target_indexes) > 1
+    old_count = len(old_samples)
+    header = in_f.readline().rstrip('\n').split('\t')
+    if split_targets:
         outline = ['#Index']
-        outline.extend(sample_ids)
+        for group, target_idx in enumerate(target_indexes):
+            outline.extend(header[1 + group * old_count:1 + (group + 1) * old_count])
+            outline.extend(['%s_%d' % (sample_id, targets[target_idx]) for sample_id in new_samples])
+    else:
+        outline = header + list(new_samples)
+    out_f.write('\t'.join(outline) + '\n')
+    rows = 0
+    for row, line in enumerate(in_f):
+        line = line.rstrip('\n')
+        if split_targets:
+            tokens = line.split('\t')
+            outline = [tokens[0]]
+            for group, target_idx in enumerate(target_indexes):
+                outline.extend(tokens[1 + group * old_count:1 + (group + 1) * old_count])
+                outline.extend([column.get(row, default) for column in columns[target_idx]])
+        else:
+            outline = [line]
+            outline.extend([column.get(row, default) for column in columns[target_indexes[0]]])
+        out_f.write('\t'.join(outline) + '\n')
+        rows += 1
+    if rows != old_keys:
+        logger.error('%s: %d rows, the index has %d' % (in_f.name, rows, old_keys))
+        sys.exit(1)
+    old_defaults = [default] * old_count
+    for row in range(old_keys, len(merge_matrix['keys'])):
+        outline = [merge_matrix['keys'][row]]
+        for target_idx in target_indexes:
+            outline.extend(old_defaults)
+            outline.extend([column.get(row, default) for column in columns[target_idx]])
         out_f.write('\t'.join(outline) + '\n')
-        # merge result
-        for index in merge_dict:
-            outline = [index]
-            outline.extend(merge_dict[index])
-            out_f.write('\t'.join(outline) + '\n')
+
+def append_samples(merged_file, input_files, sample_ids, skip, index, targets, default, wide=False, jobs=1):
+    # Add the samples of input_files to the matrix of a previous run (merged_file, written with the
+    # same --target/--wide/--default) without reading the earlier input files again. The sidecar
+    # index [merged_file].idx keeps the samples and the row (key) order, so the result is the
+    # same as merging all the files in one run. The files are replaced atomically.
+    merged_files = output_files(merged_file, targets, wide)
+    for filename in merged_files:
+        if not os.path.exists(filename):
+            logger.error('%s: No such file to append to' % (filename))
+            sys.exit(1)
+    index_file = index_file_name(merged_file)
+    with instrument.stage('load_index', input_file=index_file) as stage:
+        merged_index = load_merged_index(merged_files, index_file, targets, wide, default)
+        stage.add(records=len(merged_index['keys']))
+    old_samples = merged_index['samples']
+    for sample_id in sample_ids:
+        if sample_id in old_samples:
+            logger.error('Sample %s is already in %s' % (sample_id, merged_file))
+            sys.exit(1)
+    with instrument.stage('parse') as stage:
+        merge_matrix = merge_files(input_files, skip, index, targets, default, jobs, merged_index['keys'])
+        stage.add(records=len(merge_matrix['keys']) - len(merged_index['keys']))
+    if len(merged_files) == 1:
+        file_targets = [list(range(len(targets)))]
+    else:
+        file_targets = [[target_idx] for target_idx in range(len(targets))]
+    with instrument.stage('append_output') as stage:
+        for filename, target_indexes in zip(merged_files, file_targets):
+            tmp_file = '%s.tmp%d' % (filename, os.getpid())
+            try:
+                with open(filename, 'r', newline='') as in_f, open(tmp_file, 'w', newline='') as out_f:
+                    append_rows(in_f, out_f, old_samples, sample_ids, merge_matrix, targets, target_indexes, default, len(merged_index['keys']), wide)
+                os.replace(tmp_file, filename)
+            finally:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+        stage.add(records=len(merge_matrix['keys']))
+    write_merged_index(index_file, merged_files, old_samples + list(sample_ids), merge_matrix['keys'], targets, wide, default)
+
+def write_merged_index(index_file, merged_files, samples, keys, targets, wide, default, sorted_rows=False):
+    # the samples, rows and options of a merged matrix, so --append_to can check the options
+    # and does not need to read the matrix again
+    # a --sorted matrix only gets a marker (keys = None), --append_to refuses it
+    merged_index = {
+        'version': __version__,
+        'samples': samples,
+        'targets': targets,
+        'wide': wide,
+        'default': default,
+        'sorted': sorted_rows,
+        'files': [dict(name=os.path.basename(merged_file), **file_state(merged_file)) for merged_file in merged_files],
+        'keys': keys
+    }
+    tmp_file = '%s.tmp%d' % (index_file, os.getpid())
+    with open(tmp_file, 'w') as out_f:
+        json.dump(merged_index, out_f)
+    os.replace(tmp_file, index_file)
 
 def main():
     import argparse
@@ -73,18 +508,28 @@ def main():
 
     Quick start:
     %(prog)s -i Sample1.tsv Sample2.tsv -s Sample1 Sample2 -skip 1 -index 0 -targe 1 -default "0" -o merge.tsv
+    %(prog)s -i Sample3.tsv -s Sample3 -skip 1 -index 0 -targe 1 -default "0" -append_to merge.tsv
     """))
     # argument
     parser.add_argument('-i', '--input_files', nargs='+', help='Input files', required=True)
     parser.add_argument('-s', '--sample_ids', nargs='+', help='Sample id list')
     parser.add_argument('-skip', '--skip', type=int, help='Skip first N lines in input files, default: 0 (0-based)', default=0)
     parser.add_argument('-index', '--index', type=int, help='Specify the column number for building index, default: 0 (0-based)', default=0)
-    parser.add_argument('-target', '--target', type=int, help='Give specific column for merging files, default: 1 (0-based)', default=1)
+    parser.add_argument('-target', '--target', type=int, nargs='+', help='Give specific column(s) for merging files, default: 1 (0-based).\nWith several columns, every input file is read once and one output per column\nis written ([output]_[column].tsv), or one wide output with --wide', default=[1])
+    parser.add_argument('-wide', '--wide', action='store_true', help='Write all the target columns to one output file, headers are [sample id]_[column]')
     parser.add_argument('-default', '--default', type=str, help='Set a default value, default: NA', default='NA')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of input files parsed in parallel worker processes (not used with --sorted), default: 1', default=1)
+    parser.add_argument('-sorted', '--sorted', action='store_true', help='Out-of-core mode: sort the input files on disk and join them with a streaming merge.\nThe output rows are sorted by index and memory does not grow with the number of indexes.')
+    parser.add_argument('-buffer', '--buffer_lines', type=int, help='Lines sorted in memory before spilling a run to disk in --sorted mode, default: 1000000', default=1000000)
+    parser.add_argument('-tmp', '--tmp_dir', type=str, help='Scratch directory for --sorted mode, default: $TMPDIR or /tmp')
     parser.add_argument('-o', '--output_file', type=str, help='Specify the output filename. Default: merge.tsv', default='merge.tsv')
+    parser.add_argument('-append_to', '--append_to', type=str, help='Add the samples of the input files to the output of a previous run (written with the same\n--target/--wide/--default) instead of writing a new output; only the new input files are read.\nThe samples and rows are kept in a sidecar index ([append_to].idx), written by --write_index\nor built from the matrix at the first --append_to')
+    parser.add_argument('-idx', '--write_index', action='store_true', help='Also write the sidecar index [output].idx, so --append_to can check the --target/--wide/--default\noptions of the output (and refuse a --sorted output) without reading it')
+    instrument.add_arguments(parser)
     parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
 
     args = parser.parse_args()
+    instrument.start('merge_table', __version__, args)
 
     # check if items in input_files and sample_ids list is the same
     if args.sample_ids:
@@ -98,11 +543,47 @@ def main():
         logger.error('Opthon --skip does not accept negative integer: %d' % (args.skip))
         sys.exit(1)
 
-    # merge
-    merge_dict = merge_files(args.input_files, args.skip, args.index, args.target, args.default)
+    if args.jobs < 1:
+        logger.error('Opthon --jobs requires a positive integer: %d' % (args.jobs))
+        sys.exit(1)
+
+    if args.buffer_lines < 1:
+        logger.error('Opthon --buffer_lines requires a positive integer: %d' % (args.buffer_lines))
+        sys.exit(1)
+
+    if args.append_to:
+        if args.sorted:
+            logger.error('Option --append_to can not be used with --sorted')
+            sys.exit(1)
+        append_samples(args.append_to, args.input_files, args.sample_ids, args.skip, args.index, args.target, args.default, args.wide, args.jobs)
+        return
+
+    # an index of an earlier output of the same name would be stale
+    index_file = index_file_name(args.output_file)
+    if os.path.exists(index_file):
+        os.remove(index_file)
+    if args.sorted:
+        if args.jobs > 1:
+            logger.warning('Option --jobs is not used with --sorted, the input files are sorted one after another')
+        # merge and write out as the rows are joined
+        rows = merge_files_sorted(args.input_files, args.skip, args.index, args.target, args.default, args.tmp_dir, args.buffer_lines)
+        # the join runs as the rows are written, the sort stages are recorded by merge_files_sorted()
+        with instrument.stage('join_output'):
+            write_rows(rows, args.sample_ids, args.target, args.output_file, args.wide)
+        if args.write_index:
+            write_merged_index(index_file, output_files(args.output_file, args.target, args.wide), args.sample_ids, None, args.target, args.wide, args.default, sorted_rows=True)
+    else:
+        # merge
+        with instrument.stage('parse') as stage:
+            merge_matrix = merge_files(args.input_files, args.skip, args.index, args.target, args.default, args.jobs)
+            stage.add(records=len(merge_matrix['keys']))
 
-    # write out
-    output_result(merge_dict, args.sample_ids, args.output_file)
+        # write out
+        with instrument.stage('output') as stage:
+            output_result(merge_matrix, args.sample_ids, args.target, args.output_file, args.default, args.wide)
+            if args.write_index:
+                write_merged_index(index_file, output_files(args.output_file, args.target, args.wide), args.sample_ids, merge_matrix['keys'], args.target, args.wide, args.default)
+            stage.add(records=len(merge_matrix['keys']))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
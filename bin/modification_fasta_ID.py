@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 # Contributed by Li-Mei Chiang <dytk2134 [at] gmail [dot] com> (2020)
 
-import os
+import re
 import sys
-import gzip
 import logging
+import compressed_io
+import instrument
+from fasta_core import transfor_dict, load_mapping, compile_rules, rewrite_fasta
 
 __version__ = '1.0.0'
 
@@ -16,7 +18,6 @@ if not logger.handlers:
     lh.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
     logger.addHandler(lh)
 
-
 def main():
     import argparse
     from textwrap import dedent
@@ -24,50 +25,38 @@ def main():
     This script is used to modify ID in FASTA file
 
     Quick start:
-    %(prog)s 
+    %(prog)s -i input.fasta -o output.fasta -s summary.txt
+    %(prog)s -i input.fasta -o output.fasta -s summary.txt -m mapping.tsv
     """))
     # argument
-    parser.add_argument('-i', '--input_file', type=str, help='input FASTA file ', required=True)
+    parser.add_argument('-i', '--input_file', type=str, help='input FASTA file (plain, gzip or BGZF)', required=True)
     parser.add_argument('-o', '--output_file', type=str, help='Specify the output filename', required=True)
     parser.add_argument('-s', '--summary', type=str, help='summary', required=True)
+    parser.add_argument('-m', '--mapping', type=str, help='Mapping file of OLD<TAB>NEW rules applied to every ID,\ndefault: digits to letters (1->A 2->B 3->C 4->D 5->E 6->F 7->G 8->I 9->J 0->K)')
+    parser.add_argument('-regex', '--regex', action='store_true', help='The OLD column of the mapping file contains regular expressions')
+    parser.add_argument('-t', '--threads', type=int, help='Threads for BGZF decompression/compression, default: 1', default=1)
+    parser.add_argument('-c', '--compress', action='store_true', help='Write BGZF compressed output')
+    instrument.add_arguments(parser)
     parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
 
     args = parser.parse_args()
-
-    ids_dict = dict()
-    transfor_dict = {
-        '1': 'A',
-        '2': 'B',
-        '3': 'C',
-        '4': 'D',
-        '5': 'E',
-        '6': 'F',
-        '7': 'G',
-        '8': 'I',
-        '9': 'J',
-        '0': 'K'
-    }
-    with open(args.output_file, 'w') as out_f:
-        with open(args.input_file, 'r') as in_f:
-            for line in in_f:
-                line = line.strip()
-                if line:
-                    if line[0] == '>':
-                        lines = line.split(' ')
-                        IDs = lines[0][1:]
-                        newIDs = str()
-                        for i in IDs:
-                            if i in transfor_dict:
-                                newIDs += transfor_dict[i]
-                            else:
-                                newIDs += i
-                        ids_dict[IDs] = newIDs
-                        line = '>' + newIDs
-                out_f.write(line + '\n')
-
-    with open(args.summary, 'w') as out_f:
-        for ID in ids_dict:
-            outline = [ID, ids_dict[ID]]
-            out_f.write('\t'.join(outline) + '\n')
+    instrument.start('modification_fasta_ID', __version__, args)
+
+    if args.mapping:
+        mapping = load_mapping(args.mapping)
+    else:
+        mapping = transfor_dict
+    try:
+        rewrite_id = compile_rules(mapping, args.regex)
+    except re.error as e:
+        logger.error('Invalid regular expression in %s: %s' % (args.mapping, e))
+        sys.exit(1)
+    with instrument.stage('rewrite', input_file=args.input_file):
+        with compressed_io.open_output(args.output_file, args.compress, args.threads, text=False) as out_f:
+            with compressed_io.open_input(args.input_file, args.threads) as in_f:
+                with open(args.summary, 'wb') as summary_f:
+                    collisions = rewrite_fasta(in_f, out_f, summary_f, rewrite_id)
+    if collisions:
+        logger.warning('%d ID(s) were modified to an ID already used by another sequence' % (collisions))
 if __name__ == '__main__':
     main()
@@ -2,13 +2,26 @@
 # -*- coding: utf-8 -*-
 # Contributed by Li-Mei Chiang <dytk2134 [at] gmail [dot] com> (2020)
 
+"""
+
+Changelog:
+    1.2.0: Only read and write the selected variables (-col/--columns); read the chunks in parallel worker
+           processes (--jobs, with --chunksize); per-stage statistics (--stats) and cProfile output (--profile)
+    1.1.0: Convert in chunks of --chunksize rows to bound the memory; Parquet and Feather output (--format),
+           the default output name follows the format (output.tsv, output.parquet, output.feather)
+
+"""
+
 import os
 import sys
+import json
+import multiprocessing
 import pandas as pd
 import pyreadstat
 import logging
+import instrument
 
-__version__ = '1.0.0'
+__version__ = '1.2.0'
 
 # logger
 logger = logging.getLogger(__name__)
@@ -18,18 +31,120 @@ if not logger.handlers:
     lh.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
     logger.addHandler(lh)
 
-def sav_to_tsv(input_file, output_file):
+OUTPUT_FORMATS = ['tsv', 'parquet', 'feather']
+
+def write_header(out_f, column_names, column_labels):
+    # column names, then the sav tags (column labels) as the first row
+    pd.DataFrame([column_labels], columns=column_names).to_csv(out_f, sep='\t', index=False)
+
+def import_pyarrow(output_format):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.ipc
+    except ImportError:
+        logger.error('pyarrow is required for --format %s' % (output_format))
+        sys.exit(1)
+    return pyarrow
+
+def arrow_schema(pa, schema, meta):
+    # keep the SPSS column labels and value labels as field metadata
+    column_labels = dict(zip(meta.column_names, meta.column_labels))
+    fields = list()
+    for field in schema:
+        field_metadata = dict()
+        if column_labels.get(field.name):
+            field_metadata['label'] = column_labels[field.name]
+        if field.name in meta.variable_value_labels:
+            value_labels = meta.variable_value_labels[field.name]
+            field_metadata['value_labels'] = json.dumps(dict((str(value), label) for value, label in value_labels.items()))
+        fields.append(field.with_metadata(field_metadata) if field_metadata else field)
+    return pa.schema(fields, metadata=schema.metadata)
+
+class TableWriter(object):
+    # write the chunks of a sav file as TSV, Parquet (one row group per chunk) or Feather (Arrow IPC)
+    def __init__(self, output_file, output_format, meta):
+        self.output_file = output_file
+        self.output_format = output_format
+        self.meta = meta
+        self.writer = None
+        if output_format == 'tsv':
+            self.out_f = open(output_file, 'w')
+            write_header(self.out_f, meta.column_names, meta.column_labels)
+        else:
+            self.pa = import_pyarrow(output_format)
+
+    def write(self, chunk):
+        # chunk = DataFrame, or TSV text already formatted by a worker
+        if self.output_format == 'tsv':
+            if isinstance(chunk, str):
+                self.out_f.write(chunk)
+            else:
+                chunk.to_csv(self.out_f, sep='\t', index=False, header=False)
+            return
+        if self.writer is None:
+            # the schema of the first chunk is used for all the chunks
+            schema = self.pa.Schema.from_pandas(chunk, preserve_index=False)
+            self.schema = arrow_schema(self.pa, schema, self.meta)
+            if self.output_format == 'parquet':
+                self.writer = self.pa.parquet.ParquetWriter(self.output_file, self.schema)
+            else:
+                self.writer = self.pa.ipc.new_file(self.output_file, self.schema)
+        self.writer.write_table(self.pa.Table.from_pandas(chunk, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        if self.output_format == 'tsv':
+            self.out_f.close()
+        elif self.writer is None:
+            # no rows, still write the (empty) table
+            self.write(pd.DataFrame(columns=self.meta.column_names))
+            self.writer.close()
+        else:
+            self.writer.close()
+
+def read_chunk(job):
+    # read rows [row_offset, row_offset + row_limit), TSV output is formatted here as well
+    input_file, row_offset, row_limit, usecols, output_format = job
+    df, meta = pyreadstat.read_sav(input_file, row_offset=row_offset, row_limit=row_limit, usecols=usecols)
+    if output_format == 'tsv':
+        return df.to_csv(None, sep='\t', index=False, header=False)
+    return df
+
+def sav_to_tsv(input_file, output_file, chunksize=0, jobs=1, output_format='tsv', columns=None):
     if not os.path.exists(input_file):
         logger.error('%s: No Such file or directory' % (input_file))
         sys.exit(1)
-    # read sav file
-    df, meta = pyreadstat.read_sav(input_file)
-    # add sav tags to first row
-    df.loc[-1] = meta.column_labels
-    df.index = df.index + 1
-    df.sort_index(inplace=True)
-    # write out
-    df.to_csv(output_file, sep='\t', index=False)
+    if columns:
+        # only read the requested variables
+        df, meta = pyreadstat.read_sav(input_file, metadataonly=True)
+        missing = [column for column in columns if column not in meta.column_names]
+        if missing:
+            logger.error('%s: No such column(s): %s' % (input_file, ', '.join(missing)))
+            sys.exit(1)
+    if not chunksize:
+        # read sav file
+        df, meta = pyreadstat.read_sav(input_file, usecols=columns)
+        # write out
+        writer = TableWriter(output_file, output_format, meta)
+        writer.write(df)
+        writer.close()
+        return
+    # chunked mode: memory is bounded by chunksize rows (per worker)
+    df, meta = pyreadstat.read_sav(input_file, metadataonly=True, usecols=columns)
+    writer = TableWriter(output_file, output_format, meta)
+    if jobs > 1 and meta.number_rows:
+        # read the chunks in worker processes, imap() returns them in file order
+        chunk_jobs = [(input_file, row_offset, chunksize, columns, output_format) for row_offset in range(0, meta.number_rows, chunksize)]
+        pool = multiprocessing.Pool(jobs)
+        try:
+            for chunk in pool.imap(read_chunk, chunk_jobs):
+                writer.write(chunk)
+        finally:
+            pool.terminate()
+    else:
+        for df, meta in pyreadstat.read_file_in_chunks(pyreadstat.read_sav, input_file, chunksize=chunksize, usecols=columns):
+            writer.write(df)
+    writer.close()
 
 def main():
     import argparse
@@ -38,16 +153,32 @@ def main():
 
     example:
     %(prog)s -i input.sav -o output.tsv
+    %(prog)s -i input.sav -o output.parquet -f parquet -col age sex bmi
 
     version:
     """ + __version__))
     # argument
     parser.add_argument('-i', '--input', type=str, help='input sav', required=True)
-    parser.add_argument('-o', '--output', type=str, default='output.tsv', help='output tsv')
+    parser.add_argument('-o', '--output', type=str, help='output file, default: output.[format] (output.tsv, output.parquet or output.feather)')
+    parser.add_argument('-f', '--format', type=str, choices=OUTPUT_FORMATS, default='tsv', help='output format, parquet and feather keep the dtypes,\nthe column labels and the value labels (field metadata), default: tsv')
+    parser.add_argument('-col', '--columns', nargs='+', help='only read and write these variables, default: all')
+    parser.add_argument('-c', '--chunksize', type=int, default=0, help='convert the sav file in chunks of N rows to bound the memory, default: 0 (whole file)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes reading chunks in parallel (with --chunksize), default: 1')
+    instrument.add_arguments(parser)
     parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
 
     args = parser.parse_args()
-    sav_to_tsv(args.input, args.output)
+    instrument.start('sav_to_tsv', __version__, args)
+    if args.chunksize < 0:
+        logger.error('Option --chunksize does not accept negative integer: %d' % (args.chunksize))
+        sys.exit(1)
+    if args.jobs < 1:
+        logger.error('Option --jobs requires a positive integer: %d' % (args.jobs))
+        sys.exit(1)
+    if args.output is None:
+        args.output = 'output.' + args.format
+    with instrument.stage('convert', input_file=args.input):
+        sav_to_tsv(args.input, args.output, args.chunksize, args.jobs, args.format, args.columns)
 
 
 if __name__ == '__main__':
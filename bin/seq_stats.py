@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# Sequence content statistics and filters for FilterFastaByLength.py, computed with NumPy over
+# the raw bytes of every sequence (no per-base Python loop):
+#   GC              (G + C) / (A + C + G + T), NA when the sequence has no A/C/G/T
+#   N               fraction of the bases that are not A/C/G/T(/U): N and the IUPAC ambiguity codes
+#   Complexity      highest DUST score of the 64-triplet windows of the sequence, the
+#                   triplet counts c of a window score sum(c * (c - 1) / 2) / (l - 1) with
+#                   l = triplets in the window; low-complexity (repetitive) windows score high
+#   Max_Homopolymer longest run of one base (A/C/G/T)
+# Long sequences are processed in chunks, so the NumPy temporaries stay small; short sequences
+# are processed together in batches, so the NumPy call overhead is not paid per record.
+# numpy is only imported when the statistics are requested.
+
+import sys
+import logging
+
+__version__ = '1.0.0'
+
+# logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    lh = logging.StreamHandler()
+    lh.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
+    logger.addHandler(lh)
+
+STAT_COLUMNS = ['GC', 'N', 'Complexity', 'Max_Homopolymer']
+# bases per chunk of a long sequence, a multiple of the DUST window, so the windows are the
+# same in every chunk
+CHUNK_SIZE = 1 << 20
+# short sequences are processed together in batches of up to BATCH_SIZE bases
+BATCH_SIZE = 1 << 20
+BATCH_RECORDS = 4096
+DUST_WINDOW = 64
+# triplet code of a triplet with an ambiguous base
+NO_TRIPLET = 64
+# records collected before they are added to the histograms
+HISTOGRAM_BATCH = 4096
+LENGTH_BINS = [0, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000, 500000, 1000000, 10000000, 100000000]
+GC_BIN_COUNT = 20
+
+
+def import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        logger.error('numpy is required for the sequence content statistics and filters')
+        sys.exit(1)
+    return numpy
+
+
+def longest_run(np, mask):
+    # length of the longest run of True in a boolean array, by doubling the run length tested
+    # (runs[i]: mask[i:i + k] is all True) and then a binary search between k and 2k
+    if not mask.any():
+        return 0
+    k = 1
+    runs = mask
+    while True:
+        longer = runs[:-k] & runs[k:]
+        if not longer.any():
+            break
+        runs, k = longer, k * 2
+    step = k // 2
+    while step:
+        longer = runs[:-step] & runs[step:]
+        if longer.any():
+            runs, k = longer, k + step
+        step //= 2
+    return k
+
+
+class ContentStats(object):
+    # compute the statistics of sequences (bytes)
+    def __init__(self):
+        np = import_numpy()
+        self.np = np
+        # byte -> base code: A=0 C=1 G=2 T/U=3, anything else 4
+        self.base_code = np.full(256, 4, dtype=np.uint8)
+        for bases, code in [(b'Aa', 0), (b'Cc', 1), (b'Gg', 2), (b'TtUu', 3)]:
+            for base in bytearray(bases):
+                self.base_code[base] = code
+        # (first * 5 + second) * 5 + third -> triplet code 0-63, NO_TRIPLET with an ambiguous base
+        self.triplet_code = np.full(125, NO_TRIPLET, dtype=np.uint8)
+        for first in range(4):
+            for second in range(4):
+                for third in range(4):
+                    self.triplet_code[(first * 5 + second) * 5 + third] = first * 16 + second * 4 + third
+        # bincount offset of every triplet of a chunk: window * (NO_TRIPLET + 1)
+        self.window_offsets = np.repeat(np.arange(CHUNK_SIZE // DUST_WINDOW, dtype=np.int32) * (NO_TRIPLET + 1), DUST_WINDOW)
+
+    def triplets(self, codes):
+        # triplet codes of codes[i:i + 3]
+        return self.triplet_code[(codes[:-2] * 5 + codes[1:-1]) * 5 + codes[2:]]
+
+    def window_scores(self, window_triplets, window_count):
+        # DUST score of every window: window_triplets = window * (NO_TRIPLET + 1) + triplet code
+        # sum(c * (c - 1) / 2) = (sum(c * c) - sum(c)) / 2
+        np = self.np
+        counts = np.bincount(window_triplets, minlength=window_count * (NO_TRIPLET + 1)).reshape(window_count, NO_TRIPLET + 1)[:, :NO_TRIPLET]
+        valid = counts.sum(axis=1)
+        return ((np.einsum('ij,ij->i', counts, counts) - valid) // 2) / np.maximum(valid - 1, 1).astype(np.float64)
+
+    def sequence_stats(self, sequence):
+        # statistics of one sequence, processed in chunks of CHUNK_SIZE bases
+        # return (GC or None, N, Complexity, Max_Homopolymer)
+        np = self.np
+        length = len(sequence)
+        codes = self.base_code.take(np.frombuffer(sequence, dtype=np.uint8))
+        base_counts = np.zeros(5, dtype=np.int64)
+        max_homopolymer = 0
+        # trailing run of the previous chunk: (base code, run length)
+        run_code, run_length = 4, 0
+        complexity = 0.0
+        for start in range(0, length, CHUNK_SIZE):
+            end = min(start + CHUNK_SIZE, length)
+            chunk = codes[start:end]
+            chunk_counts = np.bincount(chunk, minlength=5)
+            base_counts += chunk_counts
+            # same[i]: chunk[i + 1] continues the run of chunk[i]
+            same = (chunk[1:] == chunk[:-1]) & (chunk[1:] < 4)
+            if chunk_counts[:4].any():
+                max_homopolymer = max(max_homopolymer, longest_run(np, same) + 1)
+            # runs crossing the chunk boundaries
+            single_run = bool(same.all())
+            first_code, last_code = int(chunk[0]), int(chunk[-1])
+            if first_code < 4 and first_code == run_code:
+                leading = len(chunk) if single_run else int(np.argmin(same)) + 1
+                max_homopolymer = max(max_homopolymer, run_length + leading)
+            if single_run and first_code < 4 and first_code == run_code:
+                run_length += len(chunk)
+            elif last_code < 4:
+                run_code, run_length = last_code, len(chunk) if single_run else int(np.argmin(same[::-1])) + 1
+            else:
+                run_code, run_length = 4, 0
+            # triplets starting in this chunk, they may end in the next one
+            window = codes[start:min(end + 2, length)]
+            if len(window) >= 3:
+                triplets = self.triplets(window)[:end - start]
+                window_count = -(-len(triplets) // DUST_WINDOW)
+                scores = self.window_scores(self.window_offsets[:len(triplets)] + triplets, window_count)
+                complexity = max(complexity, float(scores.max()))
+        gc = None
+        acgt = int(base_counts[:4].sum())
+        if acgt:
+            gc = float(base_counts[1] + base_counts[2]) / acgt
+        n = float(base_counts[4]) / length if length else 0.0
+        return gc, n, complexity, max_homopolymer
+
+    def batch_stats(self, sequences):
+        # statistics of many short sequences in one vectorized pass over their concatenation
+        # return [(GC or None, N, Complexity, Max_Homopolymer)]
+        np = self.np
+        record_count = len(sequences)
+        lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int32)
+        starts = np.zeros(record_count, dtype=np.int32)
+        np.cumsum(lengths[:-1], out=starts[1:])
+        ends = starts + lengths
+        codes = self.base_code.take(np.frombuffer(b''.join(sequences), dtype=np.uint8))
+        total = len(codes)
+        # record of every base
+        records = np.repeat(np.arange(record_count, dtype=np.int32), lengths)
+        base_counts = np.bincount(records * 5 + codes, minlength=record_count * 5).reshape(record_count, 5)
+        # homopolymer runs, a run also ends at the end of a record
+        max_homopolymer = np.zeros(record_count, dtype=np.int64)
+        nonempty = lengths > 0
+        if total:
+            change = np.ones(total, dtype=bool)
+            change[1:] = codes[1:] != codes[:-1]
+            change[starts[nonempty]] = True
+            run_starts = np.flatnonzero(change)
+            run_lengths = np.diff(np.append(run_starts, total))
+            run_lengths[codes[run_starts] == 4] = 0
+            # every record starts a run, the runs of a record are reduced together
+            max_homopolymer[nonempty] = np.maximum.reduceat(run_lengths, np.searchsorted(run_starts, starts[nonempty]))
+        # DUST windows of every record, numbered one record after the other from 1; the
+        # triplets running past the end of their record are left in window 0 or in the last
+        # window of the record as NO_TRIPLET, which is not counted
+        complexity = np.zeros(record_count, dtype=np.float64)
+        window_counts = (np.maximum(lengths - 2, 0) + DUST_WINDOW - 1) // DUST_WINDOW
+        window_total = int(window_counts.sum())
+        if window_total:
+            outside = np.zeros(total, dtype=bool)
+            outside[ends[lengths >= 1] - 1] = True
+            outside[ends[lengths >= 2] - 2] = True
+            outside = outside[:-2]
+            triplets = self.triplets(codes)
+            triplets[outside] = NO_TRIPLET
+            # position of every triplet in its record
+            positions = np.arange(total - 2, dtype=np.int32) - np.repeat(starts, lengths)[:-2]
+            new_window = (positions % DUST_WINDOW == 0) & ~outside
+            windows = np.cumsum(new_window, dtype=np.int32)
+            scores = self.window_scores(windows * (NO_TRIPLET + 1) + triplets, window_total + 1)[1:]
+            has_windows = window_counts > 0
+            window_starts = np.cumsum(window_counts) - window_counts
+            complexity[has_windows] = np.maximum.reduceat(scores, window_starts[has_windows])
+        acgt = base_counts[:, :4].sum(axis=1)
+        gc = (base_counts[:, 1] + base_counts[:, 2]) / np.maximum(acgt, 1).astype(np.float64)
+        n = base_counts[:, 4] / np.maximum(lengths, 1).astype(np.float64)
+        gc = [value if count else None for value, count in zip(gc.tolist(), acgt.tolist())]
+        return list(zip(gc, n.tolist(), complexity.tolist(), max_homopolymer.tolist()))
+
+
+class Histogram(object):
+    # length and GC histograms of all the sequences of a file, values are added in batches
+    def __init__(self, np):
+        self.np = np
+        self.length_edges = np.array(LENGTH_BINS, dtype=np.int64)
+        self.length_counts = np.zeros(len(LENGTH_BINS), dtype=np.int64)
+        self.gc_counts = np.zeros(GC_BIN_COUNT, dtype=np.int64)
+        self.gc_na = 0
+        self.lengths = list()
+        self.gcs = list()
+        self.records = 0
+        self.bases = 0
+
+    def add(self, length, gc):
+        self.records += 1
+        self.bases += length
+        self.lengths.append(length)
+        if gc is None:
+            self.gc_na += 1
+        else:
+            self.gcs.append(gc)
+        if len(self.lengths) >= HISTOGRAM_BATCH:
+            self.flush()
+
+    def flush(self):
+        np = self.np
+        if self.lengths:
+            bins = np.searchsorted(self.length_edges, np.array(self.lengths, dtype=np.int64), side='right') - 1
+            self.length_counts += np.bincount(bins, minlength=len(self.length_counts))
+            self.lengths = list()
+        if self.gcs:
+            bins = np.minimum((np.array(self.gcs) * GC_BIN_COUNT).astype(np.int64), GC_BIN_COUNT - 1)
+            self.gc_counts += np.bincount(bins, minlength=GC_BIN_COUNT)
+            self.gcs = list()
+
+    def write(self, out_f, input_file):
+        self.flush()
+        out_f.write('#filename: %s\n' % (input_file))
+        out_f.write('#records: %d\tbases: %d\n' % (self.records, self.bases))
+        out_f.write('#Length_Bin\tCount\n')
+        for idx, count in enumerate(self.length_counts):
+            if idx + 1 < len(LENGTH_BINS):
+                out_f.write('[%d,%d)\t%d\n' % (LENGTH_BINS[idx], LENGTH_BINS[idx + 1], count))
+            else:
+                out_f.write('>=%d\t%d\n' % (LENGTH_BINS[idx], count))
+        out_f.write('#GC_Bin\tCount\n')
+        for idx, count in enumerate(self.gc_counts):
+            closing = ']' if idx + 1 == GC_BIN_COUNT else ')'
+            out_f.write('[%.2f,%.2f%s\t%d\n' % (float(idx) / GC_BIN_COUNT, float(idx + 1) / GC_BIN_COUNT, closing, count))
+        out_f.write('NA\t%d\n' % (self.gc_na))
+
+
+class ContentFilter(object):
+    # The statistics as report columns, the thresholds and the histograms, passed to
+    # fasta_core.run_pipeline(). A threshold of None is not checked; a sequence without
+    # A/C/G/T (GC = NA) fails --min_gc and --max_gc.
+    def __init__(self, min_gc=None, max_gc=None, max_n=None, max_complexity=None, max_homopolymer=None, histogram=False):
+        self.stats = ContentStats()
+        self.min_gc = min_gc
+        self.max_gc = max_gc
+        self.max_n = max_n
+        self.max_complexity = max_complexity
+        self.max_homopolymer = max_homopolymer
+        self.histogram = Histogram(self.stats.np) if histogram else None
+
+    def passed(self, gc, n, complexity, max_homopolymer):
+        if self.min_gc is not None or self.max_gc is not None:
+            if gc is None or (self.min_gc is not None and gc < self.min_gc) or (self.max_gc is not None and gc > self.max_gc):
+                return False
+        if self.max_n is not None and n > self.max_n:
+            return False
+        if self.max_complexity is not None and complexity > self.max_complexity:
+            return False
+        if self.max_homopolymer is not None and max_homopolymer > self.max_homopolymer:
+            return False
+        return True
+
+    def annotate(self, records):
+        # records = iterable of (fasta_id, sequence_list)
+        # yield (fasta_id, sequence_list, [report column values], passed) in the same order;
+        # short sequences are buffered and processed in batches, long ones one by one
+        batch = list()
+        batch_size = 0
+        for fasta_id, sequence_list in records:
+            sequence = ''.join(sequence_list).encode('utf-8')
+            if len(sequence) > CHUNK_SIZE:
+                for record in self.process(batch):
+                    yield record
+                batch = list()
+                batch_size = 0
+                for record in self.process([(fasta_id, sequence_list, sequence)], long_sequence=True):
+                    yield record
+                continue
+            batch.append((fasta_id, sequence_list, sequence))
+            batch_size += len(sequence)
+            if batch_size >= BATCH_SIZE or len(batch) >= BATCH_RECORDS:
+                for record in self.process(batch):
+                    yield record
+                batch = list()
+                batch_size = 0
+        for record in self.process(batch):
+            yield record
+
+    def process(self, batch, long_sequence=False):
+        if not batch:
+            return
+        if long_sequence:
+            results = [self.stats.sequence_stats(sequence) for fasta_id, sequence_list, sequence in batch]
+        else:
+            results = self.stats.batch_stats([sequence for fasta_id, sequence_list, sequence in batch])
+        for (fasta_id, sequence_list, sequence), (gc, n, complexity, max_homopolymer) in zip(batch, results):
+            if self.histogram is not None:
+                self.histogram.add(sum(len(line) for line in sequence_list), gc)
+            values = ['NA' if gc is None else '%.4f' % (gc), '%.4f' % (n), '%.4f' % (complexity), str(max_homopolymer)]
+            yield fasta_id, sequence_list, values, self.passed(gc, n, complexity, max_homopolymer)